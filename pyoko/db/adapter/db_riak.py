@@ -7,41 +7,66 @@ this module contains a base class for other db access classes
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import copy
 
 # noinspection PyCompatibility
 import json
+import re
 from datetime import date, timedelta
 import time
 from datetime import datetime
+from functools import partial
+from uuid import uuid4
 from riak.util import bytes_to_str
 
 from pyoko.db.adapter.base import BaseAdapter
 from pyoko.fields import DATE_FORMAT, DATE_TIME_FORMAT
 import concurrent.futures as con
-from math import ceil
-from pyoko.db.connection import PyokoMG
-from pyoko.lib.utils import ub_to_str
+from pyoko.db.connection import get_multiget_pool, get_executor
+from pyoko.lib.utils import ub_to_str, un_camel_id, LRUCache, dict_diff, apply_dict_diff
 
 try:
     from urllib.request import urlopen
+    from urllib.parse import urlencode
 except ImportError:
     from urllib2 import urlopen
+    from urllib import urlencode
 
 from enum import Enum
 import six
+from six.moves import http_client
 from pyoko.conf import settings
-from pyoko.db.connection import client, cache, log_bucket, version_bucket
+from pyoko.db.connection import client, cache, log_bucket, version_bucket, http_get
+from pyoko.db import local_cache, visibility, write_behind, write_overlay
+from pyoko.db.visibility import VisibilityWaiter
 import riak
-from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, PyokoError
+from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, PyokoError, \
+    IntegrityError
 from collections import OrderedDict
 
 import sys
 
 ReturnType = Enum('ReturnType', 'Solr Object Model')
 
+# solr special characters, escaped in a single pass
+SOLR_ESCAPE_RE = re.compile(r'(&&|\|\||[+\-!(){}\[\]^"~*?: ])')
+
+# (version key, data, number of diffs since snapshot) of the last
+# version of objects, new versions are diffed against them
+LAST_VERSIONS = LRUCache(settings.VERSION_CACHE_SIZE)
+
+# rebuilt version records by their keys, versions are never updated
+VERSION_RECORDS = LRUCache(settings.VERSION_READ_CACHE_SIZE)
+
+# number of index entries that are read at once while listing versions
+VERSION_PAGE_SIZE = 100
+
+# first time window (in seconds) searched for the last version of an
+# object before a given time, doubled until a version is found
+VERSION_SEARCH_WINDOW = 3600
+
 sys.PYOKO_STAT_COUNTER = {
     "save": 0,
     "update": 0,
@@ -52,26 +77,20 @@ sys.PYOKO_STAT_COUNTER = {
 sys.PYOKO_LOGS = defaultdict(list)
 
 
-class BlockSave(object):
+class BlockSave(VisibilityWaiter):
+    """
+    Waits on exit until the objects of given model that are
+    saved in the block (by this thread) are indexed.
+    Time it took is kept in "elapsed" attribute.
+    """
     def __init__(self, mdl, query_dict=None):
-        self.mdl = mdl
-        self.query_dict = query_dict or {}
-        self.query_dict['updated_at__gt'] = datetime.now().strftime(DATE_TIME_FORMAT)
-
-    def __enter__(self):
-        Adapter.block_saved_keys = []
-        Adapter.COLLECT_SAVES = True
-        Adapter.COLLECT_SAVES_FOR_MODEL = self.mdl.__name__
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        key_list = set(Adapter.block_saved_keys)
-        self.make_sure(key_list)
-        Adapter.COLLECT_SAVES = False
+        query_dict = query_dict or {}
+        query_dict['updated_at__gt'] = datetime.now().strftime(DATE_TIME_FORMAT)
+        super(BlockSave, self).__init__(mdl, query_dict)
 
     def make_sure(self, key_list):
-        while Adapter.block_saved_keys and not key_list.issubset(
-                self.mdl.objects.all(**self.query_dict).values_list('key')):
-            time.sleep(.4)
+        self.add(*key_list)
+        return self.wait()
 
 
 class BlockDelete(BlockSave):
@@ -85,8 +104,6 @@ class Adapter(BaseAdapter):
     """
     QuerySet is a lazy data access layer for Riak.
     """
-    COLLECT_SAVES = False
-    block_saved_keys = []
 
     def __init__(self, **conf):
         super(Adapter, self).__init__(**conf)
@@ -98,6 +115,21 @@ class Adapter(BaseAdapter):
         # yield query result in order
         self.ordered = False
 
+        # use solr's cursorMark for deep pagination.
+        # None means decide automatically according to result count
+        self.cursor = None
+        self.page_size = self._cfg['row_size']
+
+        # filters of the last filter() call, set if result count should
+        # not exceed row_size. Checked lazily at first execution.
+        self.row_limit_filters = None
+        # number of accessible results, known after first page is fetched
+        self.result_count = None
+        # result of the first page query, see _first_page()
+        self.first_page = None
+        # vclocks of fetched objects by their keys, None means they are not kept
+        self.vclocks = None
+
         if '_model_class' in conf:
             self._model_class = conf['model_class']
         if '_current_context' in conf:
@@ -112,7 +144,7 @@ class Adapter(BaseAdapter):
         self.want_deleted = False
         # default joiner for filter arguments
         self._QUERY_GLUE = ' AND '
-        self._solr_query = []  # query parts, will be compiled before execution
+        self._solr_query = ()  # query parts, will be compiled before execution
         self._solr_params = {
             "sort": OrderedDict([("timestamp", "desc")]),
             # we need only riak key, score for riak client bug
@@ -195,135 +227,422 @@ class Adapter(BaseAdapter):
                 time.sleep(0.3)
         return i
 
-    @staticmethod
-    def get_from_solr(clone, number, row_size):
+    def riak_multi_get(self, key_list_tuple):
         """
-        If not start parameter is given, with the given number(0,1,2..) multiplies default row size
-        and determines start parameter. Takes results from solr according to this parameter. For
-        example, if number is 2 and default row size is 1000, takes results from solr between 2000
-        and 3000. But if start parameter is given, start value is found adding given start paramater.
-        For example start paramater is given as 550, if number is 2 and default row size is 1000,
-        takes results from solr between 2550 and 3550.
+        Sends given tuples of list to multiget method and took riak objs' keys and data.
+        Process-wide multiget pool is used, see :func:`pyoko.db.connection.get_multiget_pool`.
+
+        If caching is enabled, whole list is looked up in the cache with a single
+        MGET, only the missing ones are fetched from riak and written back
+        to the cache in one pipelined batch.
 
         Args:
-            clone: Queryset adapter clone
-            number(int): Uses for solr start parameter. Multiplies with default row size.
-            row_size(int): Uses for solr rows parameter. Indicates how many record will be taken
-                           from solr.
+            key_list_tuple(list of tuples): [('bucket_type','bucket','riak_key')]
+
+                                            Example:
+                                            [('models','personel','McAPchPZzB6RVJ8QI2XSVQk4mUR')]
 
         Returns:
-             tuple with given number and riak_multi_get method input list.
-             Example return = (0, [('models','personel','McAPchPZzB6RVJ8QI2XSVQk4mUR'),
-                                 ('models','personel','XyZZrsadVJ8QI2XSVQk4mUR'),
-                                 ('models','personel','SkFl3RPZzB6RVJ8QI2XSVQk4mUR'),
-                                 ('models','personel','PxCdytPZzB6RVJ8QI2XSVQk4mUR')])
+            objs(tuple): obj's key and obj's value
 
         """
-        start = number * clone._cfg['row_size'] + clone._cfg['start']
-        clone._solr_params.update({'start': start})
-        clone._solr_params.update({'rows': row_size})
-        clone._solr_locked = False
-        return number, [(clone._cfg['bucket_type'], clone._cfg['bucket_name'],
-                         ub_to_str(doc.get('_yz_rk'))) for doc in clone._exec_query()]
+        if not settings.ENABLE_CACHING or not key_list_tuple:
+            return self._strip_vclocks(
+                self._client.multiget(key_list_tuple, pool=get_multiget_pool()))
+        objs, misses = self.multi_get_from_cache(key_list_tuple)
+        if misses:
+            fetched = self._strip_vclocks(
+                self._client.multiget(misses, pool=get_multiget_pool()))
+            self.multi_set_to_cache(fetched)
+            objs.extend(fetched)
+        return objs
 
-    def riak_multi_get(self, key_list_tuple):
+    def _strip_vclocks(self, objs):
         """
-        Sends given tuples of list to multiget method and took riak objs' keys and data. For each
-        multiget call, separate pools are used and after execution, pools are stopped.
+        Multiget workers return (key, data, vclock) tuples. Vclocks are
+        kept in "vclocks" if it's set, to be attached to model instances.
+
         Args:
-            key_list_tuple(list of tuples): [('bucket_type','bucket','riak_key')]
+            objs (list): multiget results
 
-                                            Example:
-                                            [('models','personel','McAPchPZzB6RVJ8QI2XSVQk4mUR')]
+        Returns:
+            list: (key, data) tuples and error tuples.
+        """
+        result = []
+        for obj in objs:
+            if len(obj) == 3:
+                if self.vclocks is not None:
+                    self.vclocks[obj[0]] = obj[2]
+                obj = obj[:2]
+            result.append(obj)
+        return result
+
+    def _check_row_limit(self, count):
+        """
+        Raises an exception if a query built with filter() (instead of all())
+        returns more than row_size results.
+
+        Args:
+            count (int): number of accessible results
+        """
+        if self.row_limit_filters is not None and count > self._cfg['row_size']:
+            raise Exception("""Your query result count(%s) is more than specified result value(%s).
+            You can narrow your filters, you can apply your own pagination or
+            you can use all() method for getting all filter results.
+            Example Usage: Unit.objects.all()
+
+            Filters: %s  Model Class: %s
+            """ % (count, self._cfg['row_size'], self.row_limit_filters,
+                   self._model_class))
+
+    def _set_result_count(self, num_found):
+        """
+        Stores number of accessible results of the executed query
+        and checks the row limit of filter() queries.
+
+        Args:
+            num_found (int): "num_found" of the solr response
 
         Returns:
-            objs(tuple): obj's key and obj's value
+            int: number of accessible results
+        """
+        self.result_count = self._accessible_count(num_found)
+        self._check_row_limit(self.result_count)
+        return self.result_count
 
+    def _fetch_page(self, start, rows):
         """
-        pool = PyokoMG()
-        objs = self._client.multiget(key_list_tuple, pool=pool)
-        pool.stop()
-        return objs
+        Executes the query for a page with start/rows parameters.
+
+        Args:
+            start (int): solr start parameter
+            rows (int): solr rows parameter
+
+        Returns:
+            tuple: riak_multi_get input list and "num_found" of solr response
+        """
+        clone = self._clone()
+        clone._solr_params.update({'start': start, 'rows': rows})
+        docs = clone._exec_query()
+        self.want_deleted = clone.want_deleted
+        return ([(self._cfg['bucket_type'], self._cfg['bucket_name'],
+                  ub_to_str(doc['_yz_rk'])) for doc in docs],
+                clone._solr_cache['num_found'])
+
+    def _uses_cursor(self):
+        """
+        Returns:
+            bool: True if the result set is walked with solr cursors. Unless a start
+                offset is given or cursors are explicitly disabled, result sets that
+                may not fit into a single page are walked with cursors from the first
+                page on, so the first page doesn't have to be fetched again when it's
+                continued.
+        """
+        start = self._solr_params.get('start', 0)
+        rows = self._solr_params.get('rows')
+        if self.cursor and start:
+            raise PyokoError("Cursor pagination can not be used with a start offset")
+        return bool(self.cursor or (self.cursor is None and not start and
+                                    (rows is None or rows > self.page_size)))
+
+    def _first_page(self):
+        """
+        Executes the first page query of the result set, if it's not already
+        executed. It's kept in "first_page", so the number of results can be
+        taken from it before the iteration (see :meth:`QuerySet.count`).
+
+        Returns:
+            tuple: riak_multi_get input list, "num_found" of solr response and
+                the next cursor mark (None if the result set is not walked with cursors).
+        """
+        if self.first_page is None:
+            start = self._solr_params.get('start', 0)
+            rows = self._solr_params.get('rows')
+            page_rows = self.page_size if rows is None else min(self.page_size, rows)
+            if self._uses_cursor():
+                docs, num_found, next_cursor_mark = self._exec_cursor_query('*', page_rows)
+                self.first_page = ([(self._cfg['bucket_type'], self._cfg['bucket_name'],
+                                     ub_to_str(doc['_yz_rk'])) for doc in docs],
+                                   num_found, next_cursor_mark)
+            else:
+                self.first_page = self._fetch_page(start, page_rows) + (None,)
+        return self.first_page
+
+    def _key_pages(self):
+        """
+        Yields riak keys of the result set page by page.
+
+        The first page query also returns the number of results, so there is
+        no separate count query. Result sets are walked with start/rows paging
+        or with solr cursors (see :meth:`_uses_cursor` and :meth:`_cursor_pages`).
+
+        Yields:
+            riak_multi_get input list for each page.
+        """
+        if self._uses_cursor():
+            for key_list_tuple in self._cursor_pages():
+                yield key_list_tuple
+            return
+
+        start = self._solr_params.get('start', 0)
+        key_list_tuple, num_found, _ = self._first_page()
+        count = self._set_result_count(num_found)
+        offset = 0
+        while key_list_tuple:
+            yield key_list_tuple
+            offset += self.page_size
+            if offset >= count:
+                break
+            key_list_tuple, _ = self._fetch_page(start + offset,
+                                                 min(self.page_size, count - offset))
+
+    def _cursor_pages(self):
+        """
+        Walks the result set with solr's cursorMark. Unlike start/rows paging,
+        solr only has to sort "rows" documents for each page, no matter
+        how deep we are, and results don't shift between pages when
+        there are concurrent writes.
+
+        Yields:
+            riak_multi_get input list for each page.
+        """
+        cursor_mark = '*'
+        remaining = None
+        while remaining is None or remaining > 0:
+            if remaining is None:
+                key_list_tuple, num_found, next_cursor_mark = self._first_page()
+                remaining = self._set_result_count(num_found)
+            else:
+                docs, num_found, next_cursor_mark = self._exec_cursor_query(
+                    cursor_mark, min(self.page_size, remaining))
+                key_list_tuple = [(self._cfg['bucket_type'], self._cfg['bucket_name'],
+                                   ub_to_str(doc['_yz_rk'])) for doc in docs]
+            if not key_list_tuple:
+                break
+            remaining -= len(key_list_tuple)
+            yield key_list_tuple
+            if next_cursor_mark == cursor_mark:
+                break
+            cursor_mark = next_cursor_mark
+
+    def _stream_pages(self, key_pages):
+        """
+        Pipelines solr paging and riak multigets. While a page is being fetched
+        from riak, keys of the next page(s) are fetched from solr. Only
+        "STREAM_READ_AHEAD" pages are kept in flight, so memory usage and time
+        to first row doesn't grow with the size of the result set.
+
+        Pages are yielded in solr order as soon as their multiget completes.
+        Pending pages are cancelled if the consumer stops iterating.
+        Multigets run on the process-wide executor.
+
+        Args:
+            key_pages: iterable of riak_multi_get input lists.
+
+        Yields:
+            list: (data, key) tuples of a page.
+        """
+        read_ahead = max(int(settings.STREAM_READ_AHEAD), 1)
+        pending = deque()
+        exc = get_executor()
+        try:
+            for key_list_tuple in key_pages:
+                pending.append((key_list_tuple,
+                                exc.submit(self.riak_multi_get, key_list_tuple)))
+                if len(pending) > read_ahead:
+                    yield self._page_result(*pending.popleft())
+            while pending:
+                yield self._page_result(*pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def _page_result(self, key_list_tuple, future):
+        """
+        Args:
+            key_list_tuple (list): riak_multi_get input list of the page.
+            future: riak_multi_get future of the page.
+
+        Returns:
+            list: (data, key) tuples, in solr order if query is ordered.
+        """
+        objs = future.result()
+        if not self.ordered:
+            return [(obj[1], obj[0]) for obj in objs if len(obj) == 2]
+        objs = dict(obj for obj in objs if len(obj) == 2)
+        return [(objs.get(key), key) for _, _, key in key_list_tuple]
 
     def __iter__(self):
         """
         Gets riak keys from solr an ordered and with these keys takes riak objs' keys and data from
-        riak. While taking data from riak executes threaded. According to demanded type
-        (ordered, unordered) yields key and data.
+        riak. Solr paging and riak multigets are pipelined, see :meth:`_stream_pages`.
+        According to demanded type (ordered, unordered) yields key and data.
 
         Unordered type:
-            Returns data and key which are first come regardless of solr order.
+            Objects of a page are yielded in the order they are fetched from riak.
 
         Ordered type:
-            Key and value tuples are put to a list. List is transformed to dict. And according to
-            solr order, yields key and data.
+            Objects of a page are yielded in solr order.
+
+        Pages are always yielded in solr order, see :meth:`_key_pages`.
+        Number of results is available as "result_count"
+        once the first page is fetched.
 
         Returns:
             tuple: obj's data, obj's key
 
         """
-        clone = copy.deepcopy(self)
-        count = clone.count()
-        self.want_deleted = clone.want_deleted
+        for page in self.iter_pages():
+            for data, key in page:
+                yield data, key
 
-        chunk_size = ceil(count / float(self._cfg['row_size']))
-        last_chunk_size = count % self._cfg['row_size']
-
-        chunk_size_list = [(i, self._cfg['row_size']) for i in range(int(chunk_size))]
-        if last_chunk_size:
-            chunk_size_list.append((chunk_size_list.pop()[0], last_chunk_size))
-
-        if 'start' in self._solr_params:
-            self._cfg['start'] = self._solr_params['start']
-
-        page_list = []
-        with con.ThreadPoolExecutor(max_workers=10) as exc:
-            future_page_list = {exc.submit(self.get_from_solr, copy.deepcopy(self), page, row_size):
-                                    (page, row_size) for (page, row_size) in chunk_size_list}
-            for multiget_page_list in con.as_completed(future_page_list):
-                page_list.append(multiget_page_list.result())
-        exc.shutdown()
-
-        pages = []
-        with con.ThreadPoolExecutor(max_workers=5) as exc:
-            future_objs = {exc.submit(self.riak_multi_get, key_list_tuple): key_list_tuple for
-                           _, key_list_tuple in page_list}
-
-            for riak_objs in con.as_completed(future_objs):
-                objs = riak_objs.result()
-                if not self.ordered:
-                    for obj in objs:
-                        yield obj[1], obj[0]
-                else:
-                    pages.extend(objs)
-
-        if pages:
-            objs = dict(pages)
-            for _, key_list_tuple in sorted(page_list):
-                for _, _, key in key_list_tuple:
-                    yield objs.get(key), key
+    def iter_pages(self):
+        """
+        Same as iterating over the adapter, but yields
+        results page by page, see :meth:`__iter__`.
 
-    def __deepcopy__(self, memo=None):
+        Yields:
+            list: (data, key) tuples of a page.
+        """
+        pages = self._stream_pages(self._key_pages())
+        filters = self._overlay_filters()
+        if filters is None:
+            return pages
+        return self._merge_overlay(pages, *filters)
+
+    def _overlay_filters(self):
+        """
+        Returns:
+            tuple: Writes of the current write overlay for this model and
+                local filters of the query, None if there isn't any write
+                or the query can not be evaluated locally.
         """
-        A deep copy method that doesn't populate caches
-        and shares Riak client and bucket
-        """
-        obj = self.__class__(**self._cfg)
-        for k, v in self.__dict__.items():
-            if k.endswith(('_current_context', 'bucket', '_client', 'model_class', '_cfg')):
-                obj.__dict__[k] = v
-            elif k == '_riak_cache':
-                obj.__dict__[k] = []
-            elif k == '_solr_cache':
-                obj.__dict__[k] = {}
-            elif k == '_solr_query':
-                obj.__dict__[k] = v[:]
+        writes = write_overlay.writes_of(self._model_class.__name__)
+        if not writes or self._solr_params.get('start') or self._solr_params.get('rows'):
+            return None
+        filters = self._local_filters()
+        if filters is None:
+            return None
+        return writes, filters
+
+    def _merge_overlay(self, pages, writes, filters):
+        """
+        Drops written objects that don't match the query anymore from
+        result pages, then yields the written ones that match the query
+        but are not indexed yet as the last page.
+
+        Yields:
+            list: (data, key) tuples of a page.
+        """
+        seen = set()
+        for page in pages:
+            page = [(data, key) for data, key in page if key not in writes or
+                    (data is not None and self._matches_locally(filters, data, key))]
+            seen.update(key for data, key in page)
+            yield page
+        unindexed = [(data, key) for key, data in writes.items()
+                     if key not in seen and self._matches_locally(filters, data, key)]
+        if unindexed:
+            yield unindexed
+        self.result_count = len(seen) + len(unindexed)
+
+    def _local_filters(self):
+        """
+        Converts the query into (name, values, negated) tuples which can be evaluated
+        against stored data. Only exact and "__in" filters on keys, linked models and
+        non-text fields can be converted.
+
+        Returns:
+            list: Local filters, None if the query has any other part.
+        """
+        if self._pre_compiled_query:
+            return None
+        link_ids = set(un_camel_id(lnk['field'])
+                       for lnk in self._model_class.get_links(is_set=False))
+        filters = []
+        for key, val, is_escaped in self._solr_query:
+            if is_escaped:
+                return None
+            negated = key.startswith('-')
+            name = key.lstrip('-')
+            if name.endswith('__in'):
+                name, values = name[:-4], list(val)
+            elif hasattr(val, '_TYPE'):
+                name, values = name + '_id', [val.key]
             else:
-                obj.__dict__[k] = copy.deepcopy(v, memo)
+                values = [val]
+            if name == 'key' or name in link_ids:
+                pass
+            elif '__' in name or name not in self._model_class._fields:
+                return None
+            elif self._model_class._fields[name].solr_type.startswith('text'):
+                return None
+            filters.append((name, [self._local_query_val(v) for v in values], negated))
+        return filters
+
+    @staticmethod
+    def _local_query_val(val):
+        # same conversions with _process_query_val
+        if isinstance(val, date):
+            return val.strftime(DATE_FORMAT)
+        if hasattr(val, '_TYPE'):
+            return val.key
+        return val
+
+    @staticmethod
+    def _matches_locally(filters, data, key):
+        """
+        Args:
+            filters (list): See :meth:`_local_filters`.
+            data (dict): Stored data of the object.
+            key (str): Key of the object.
+
+        Returns:
+            bool: True if the object matches all of the filters.
+        """
+        if data.get('deleted') and not any(name == 'deleted' for name, _, _ in filters):
+            return False
+        for name, values, negated in filters:
+            current = key if name == 'key' else data.get(name)
+            matched = any((current is None or current == '') if val is None else
+                          six.text_type(current) == six.text_type(val) for val in values)
+            if matched == negated:
+                return False
+        return True
+
+    def _clone(self):
+        """
+        Copy-on-write clone of the adapter that doesn't populate caches.
+
+        Riak client and buckets are shared. Query parts are kept in an
+        immutable tuple, so they are shared too, :meth:`add_query` creates a
+        new tuple. Only config and solr parameters are copied since they
+        are updated in place.
+
+        Returns:
+            Adapter clone.
+        """
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj._cfg = self._cfg.copy()
+        obj._solr_params = self._solr_params.copy()
+        if isinstance(obj._solr_params['sort'], OrderedDict):
+            obj._solr_params['sort'] = obj._solr_params['sort'].copy()
+        obj._solr_cache = {}
+        obj.result_count = None
+        obj.first_page = None
+        obj.vclocks = None
+        obj._riak_cache = []
         obj.compiled_query = obj._pre_compiled_query or ''
         obj._solr_locked = False
         return obj
 
+    def __deepcopy__(self, memo=None):
+        """
+        Kept for backwards compatibility, see :meth:`_clone`.
+        """
+        return self._clone()
+
     def _set_bucket(self, type, name):
         """
         prepares bucket, sets index name
@@ -344,27 +663,206 @@ class Adapter(BaseAdapter):
         return self._client.bucket_type(self._cfg['bucket_type']
                                         ).bucket(self._cfg['bucket_name'])
 
-    def _write_version(self, data, model):
+    def _write_version(self, data, key):
         """
             Writes a copy of the objects current state to write-once mirror bucket.
+            It's queued to be written in background if ENABLE_WRITE_BEHIND is set.
+
+            If ENABLE_VERSION_DELTAS is set and the last stored version of the object is
+            known, only its difference from that version is written as "diff", with the key
+            of that version as "prev". Only top level fields are diffed, a changed node is
+            written as a whole. See :meth:`read_version` for reading them.
 
         Args:
             data (dict): Model instance's all data for versioning.
-            model (instance): Model instance.
+            key (str): Key of the model instance.
 
         Returns:
             Key of version record.
             key (str): Version_bucket key.
         """
         vdata = {'data': data,
-                 'key': model.key,
-                 'model': model.Meta.bucket_name,
+                 'key': key,
+                 'model': self._model_class.Meta.bucket_name,
                  'timestamp': time.time()}
-        obj = version_bucket.new(data=vdata)
-        obj.add_index('key_bin', model.key)
-        obj.add_index('model_bin', vdata['model'])
-        obj.add_index('timestamp_int', int(vdata['timestamp']))
+        indexes = [('key_bin', key),
+                   ('model_bin', vdata['model']),
+                   ('timestamp_int', int(vdata['timestamp'])),
+                   ('key_timestamp_bin', self._version_term(key, vdata['timestamp']))]
+        if not settings.ENABLE_VERSION_DELTAS:
+            return self._write_record(version_bucket, vdata, indexes)
+        last = LAST_VERSIONS.get(key)
+        if last is not None and last[2] + 1 < settings.VERSION_SNAPSHOT_INTERVAL:
+            vdata['prev'] = last[0]
+            vdata['diff'] = dict_diff(last[1], vdata.pop('data'))
+            depth = last[2] + 1
+        else:
+            depth = 0
+
+        def stored(version_key):
+            # only stored versions can be diffed against
+            LAST_VERSIONS.set(key, (version_key, data, depth))
+
+        return self._write_record(version_bucket, vdata, indexes, on_stored=stored)
+
+    @staticmethod
+    def read_version(version_key):
+        """
+        Reads a version record. Full data of diff records are rebuilt by
+        applying the diffs of the chain to the nearest full snapshot.
+
+        Args:
+            version_key (str): Version_bucket key.
+
+        Returns:
+            dict: Version record, full data of the object is in "data".
+
+        Raises:
+            ObjectDoesNotExist: If the version or a version it depends on doesn't exist.
+        """
+        cached = VERSION_RECORDS.get(version_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        record = obj = version_bucket.get(version_key)
+        diffs = []
+        data = None
+        while data is None:
+            if not obj.exists:
+                raise ObjectDoesNotExist("Version %s or a previous version of it "
+                                         "does not exist: %s" % (version_key, obj.key))
+            if 'data' in obj.data:
+                data = obj.data['data']
+                break
+            diffs.append(obj.data['diff'])
+            prev = VERSION_RECORDS.get(obj.data['prev'])
+            if prev is not None:
+                data = prev['data']
+            else:
+                obj = version_bucket.get(obj.data['prev'])
+        for diff in reversed(diffs):
+            data = apply_dict_diff(data, diff)
+        record = dict(record.data, data=data)
+        record.pop('diff', None)
+        VERSION_RECORDS.set(version_key, record)
+        return copy.deepcopy(record)
+
+    @staticmethod
+    def _version_term(key, timestamp):
+        """
+        Value of the key_timestamp_bin index of versions, timestamps
+        are zero padded so versions of an object are sorted by time.
+        """
+        return '%s:%016d' % (key, int(timestamp * 1000000))
+
+    @staticmethod
+    def _version_keys(index, startkey, endkey):
+        """
+        Streams the keys of versions in given index range, page by page.
+        """
+        for page in version_bucket.paginate_stream_index(index, startkey, endkey,
+                                                         max_results=VERSION_PAGE_SIZE):
+            try:
+                for keys in page:
+                    for version_key in keys:
+                        yield version_key
+            finally:
+                page.close()
+
+    def iter_versions(self, key, start=None, end=None):
+        """
+        Iterates over the versions of an object, oldest first.
+
+        Versions written without the key_timestamp_bin index are only
+        listed if no version of the object in the range has it.
+
+        Args:
+            key (str): Key of the object.
+            start (float): Unix timestamp, versions older than it are skipped.
+            end (float): Unix timestamp, versions newer than it are skipped.
+
+        Yields:
+            (version key, version record) tuples, see :meth:`read_version`.
+        """
+        start = 0 if start is None else start
+        endkey = ('%s:%s' % (key, '9' * 16) if end is None
+                  else self._version_term(key, end))
+        found = False
+        for version_key in self._version_keys('key_timestamp_bin',
+                                              self._version_term(key, start), endkey):
+            record = self.read_version(version_key)
+            if record['key'] == key:
+                found = True
+                yield version_key, record
+        if found:
+            return
+        records = []
+        for version_key in self._version_keys('key_bin', key, key):
+            record = self.read_version(version_key)
+            if start <= record['timestamp'] and (end is None or record['timestamp'] <= end):
+                records.append((version_key, record))
+        for version_key, record in sorted(records, key=lambda r: r[1]['timestamp']):
+            yield version_key, record
+
+    def last_version(self, key, end):
+        """
+        Finds the last version of an object before given time. Since riak
+        lists index ranges only in ascending order, the index is searched
+        backwards from given time in doubling windows (see
+        VERSION_SEARCH_WINDOW), so only the entries of the most recent
+        window are listed and read starting from the newest.
+        Versions written without the key_timestamp_bin index are looked
+        up only if there isn't any indexed version before given time.
+
+        Args:
+            key (str): Key of the object.
+            end (float): Unix timestamp.
+
+        Returns:
+            (version key, version record) tuple, None if there isn't any.
+        """
+        window_end, window = end, VERSION_SEARCH_WINDOW
+        while True:
+            window_start = max(window_end - window, 0)
+            version_keys = list(self._version_keys('key_timestamp_bin',
+                                                   self._version_term(key, window_start),
+                                                   self._version_term(key, window_end)))
+            for version_key in reversed(version_keys):
+                record = self.read_version(version_key)
+                if record['key'] == key:
+                    return version_key, record
+            if not window_start:
+                break
+            window_end, window = window_start, window * 2
+        versions = list(self.iter_versions(key, end=end))
+        return versions[-1] if versions else None
+
+    @staticmethod
+    def _write_record(bucket, data, indexes, on_stored=None):
+        """
+        Stores a version or log record, or queues it with a
+        client generated key if ENABLE_WRITE_BEHIND is set.
+
+        Args:
+            bucket: Riak bucket of the record.
+            data (dict): Data of the record.
+            indexes (list): (index name, value) tuples of secondary indexes.
+            on_stored (callable): Called with the key of the record once it's
+                stored. Never called for queued records that are dropped or failed.
+
+        Returns:
+            Key of the record.
+        """
+        if settings.ENABLE_WRITE_BEHIND:
+            key = uuid4().hex
+            write_behind.enqueue(bucket, key, dict(data), indexes,
+                                 on_stored and partial(on_stored, key))
+            return key
+        obj = bucket.new(data=data)
+        for index in indexes:
+            obj.add_index(*index)
         obj.store()
+        if on_stored is not None:
+            on_stored(obj.key)
         return obj.key
 
     def _write_log(self, version_key, meta_data, index_fields):
@@ -380,17 +878,13 @@ class Adapter(BaseAdapter):
         Returns:
 
         """
-        meta_data = meta_data or {}
-        meta_data.update({
-            'version_key': version_key,
-            'timestamp': time.time(),
-        })
-        obj = log_bucket.new(data=meta_data)
-        obj.add_index('version_key_bin', version_key)
-        obj.add_index('timestamp_int', int(meta_data['timestamp']))
+        # a new dict per record, the same meta_data is used by concurrent saves
+        meta_data = dict(meta_data or {}, version_key=version_key, timestamp=time.time())
+        indexes = [('version_key_bin', version_key),
+                   ('timestamp_int', int(meta_data['timestamp']))]
         for field, index_type in index_fields:
-            obj.add_index('%s_%s' % (field, index_type), meta_data.get(field, ""))
-        obj.store()
+            indexes.append(('%s_%s' % (field, index_type), meta_data.get(field, "")))
+        self._write_record(log_bucket, meta_data, indexes)
 
     # def save(self, data, key=None, meta_data=None):
     #     if key is not None:
@@ -409,49 +903,253 @@ class Adapter(BaseAdapter):
     #         self._write_log(version_key, meta_data)
     #     return obj.key
 
-    def save_model(self, model, meta_data=None, index_fields=None):
+    def save_model(self, model, meta_data=None, index_fields=None, blind_write=False,
+                   force=False, clean_value=None):
         """
             model (instance): Model instance.
             meta (dict): JSON serializable meta data for logging of save operation.
                 {'lorem': 'ipsum', 'dolar': 5}
             index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
                 [('lorem','bin'),('dolar','int')]
+            blind_write (bool): Store existing objects without their vclock if it's not
+                known, instead of reading them first. Last write wins.
+            force (bool): Store the model even if its data is not changed since it's
+                loaded or stored, see :meth:`_is_unchanged`.
+            clean_value (dict): Serialized data of the model, if it's already
+                serialized after its last change.
         :return:
         """
         # if model:
         #     self._model = model
         if settings.DEBUG:
             t1 = time.time()
-        clean_value = model.clean_value()
+        if clean_value is None:
+            clean_value = model.clean_value()
+        if not force and self._is_unchanged(model, clean_value):
+            return model
         model._data = clean_value
 
         if settings.DEBUG:
             t2 = time.time()
 
+        self._store_model(model, clean_value, meta_data, index_fields, blind_write)
+        self._track_write(model.key, clean_value)
+        return model
+
+    def bulk_save_models(self, models, concurrency=None, meta_data=None, index_fields=None,
+                         blind_write=False, force=False, clean_values=None):
+        """
+        Saves given model instances. All of them are serialized first, then stored
+        with at most "concurrency" stores in flight. Version and log records
+        of a model are written by the same worker after storing it.
+
+        Args:
+            models (list): Model instances.
+            concurrency (int): Number of concurrent stores, defaults to BULK_SAVE_CONCURRENCY.
+            meta_data (dict): JSON serializable meta data for logging of save operations.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+            blind_write (bool): See :meth:`save_model`.
+            force (bool): See :meth:`save_model`.
+            clean_values (list): Already serialized data of the models, in given order.
+                Models with None are serialized here.
+
+        Returns:
+            list: None for each saved model, the exception for failed ones, in given order.
+        """
+        errors = [None] * len(models)
+        cleaned = []
+        for i, model in enumerate(models):
+            try:
+                clean_value = clean_values[i] if clean_values else None
+                if clean_value is None:
+                    clean_value = model.clean_value()
+                if not force and self._is_unchanged(model, clean_value):
+                    continue
+                model._data = clean_value
+                cleaned.append((i, model))
+            except Exception as e:
+                errors[i] = e
+        pool = con.ThreadPoolExecutor(
+            max_workers=int(concurrency or settings.BULK_SAVE_CONCURRENCY))
+        try:
+            futures = [(i, pool.submit(self._store_model, model, model._data,
+                                       meta_data, index_fields, blind_write))
+                       for i, model in cleaned]
+            for i, future in futures:
+                errors[i] = future.exception()
+                if errors[i] is None:
+                    self._track_write(models[i].key, models[i]._data)
+        finally:
+            pool.shutdown(wait=True)
+        return errors
+
+    def patch_objects(self, patch, concurrency=None, versions=True, meta_data=None,
+                      index_fields=None, evict_cache=False, page_callback=None):
+        """
+        Applies given changes to the stored data of matching objects without
+        creating model instances. Keys are streamed from solr page by page,
+        each object is fetched, patched and stored back by a bounded thread pool.
+        Cache entries of the patched objects are updated (or evicted) in one batch per page.
+
+        Args:
+            patch (dict): Cleaned field values, keyed by their names in stored data.
+            concurrency (int): Number of concurrent updates, defaults to BULK_SAVE_CONCURRENCY.
+            versions (bool): False to skip writing version records.
+            meta_data (dict): JSON serializable meta data for logging of update operations.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+            evict_cache (bool): Remove patched objects from the cache instead of updating.
+            page_callback: Called with the list of patched keys after each page.
+
+        Returns:
+            int: Number of updated objects.
+        """
+        clone = self._clone()
+        if not clone._solr_params.get('start'):
+            # cursors are not affected by updated objects leaving the result set
+            clone.cursor = True
+        updated = 0
+        pool = con.ThreadPoolExecutor(
+            max_workers=int(concurrency or settings.BULK_SAVE_CONCURRENCY))
+        try:
+            for key_list_tuple in clone._key_pages():
+                futures = [pool.submit(self._patch_object, key, patch, versions,
+                                       meta_data, index_fields)
+                           for _, _, key in key_list_tuple]
+                objs = [obj for obj in (future.result() for future in futures) if obj]
+                keys = [key for key, _ in objs]
+                updated += len(objs)
+                for key, data in objs:
+                    self._track_write(key, data)
+                if settings.ENABLE_CACHING and objs:
+                    if evict_cache:
+                        self.multi_delete_from_cache(keys)
+                    else:
+                        self.multi_set_to_cache(objs)
+                        local_cache.publish_invalidation(*keys)
+                if page_callback and keys:
+                    page_callback(keys)
+        finally:
+            pool.shutdown(wait=True)
+        return updated
+
+    def _patch_object(self, key, patch, versions=True, meta_data=None, index_fields=None):
+        """
+        Args:
+            key (str): Key of the object.
+            patch (dict): Cleaned field values.
+            versions (bool): False to skip writing version record.
+            meta_data (dict): JSON serializable meta data for logging of update operation.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+
+        Returns:
+            tuple: key and patched data of the object, None if it doesn't exist anymore.
+        """
+        obj = self.bucket.get(key)
+        if not obj.exists:
+            return None
+        obj.data.update(patch)
+        obj.data['updated_at'] = datetime.now().strftime(DATE_TIME_FORMAT)
+        obj.store()
+        version_key = ''
+        if versions and settings.ENABLE_VERSIONS:
+            version_key = self._write_version(obj.data, key)
+        if settings.ENABLE_ACTIVITY_LOGGING and meta_data:
+            self._write_log(version_key, meta_data, index_fields)
+        return key, obj.data
+
+    def _track_write(self, key, data):
+        """
+        Hands a stored object to the visibility waiters and write overlays
+        of current thread. Should be called from the thread that saves it.
+
+        Args:
+            key (str): Key of the object.
+            data (dict): Stored data of the object.
+        """
+        visibility.collect(self._model_class.__name__, key)
+        write_overlay.record(self._model_class.__name__, key, data)
+
+    @staticmethod
+    def _is_unchanged(model, clean_value):
+        """
+        Args:
+            model (instance): Model instance.
+            clean_value (dict): Serialized data of the model.
+
+        Returns:
+            bool: True if serialized data is same with the data that model is
+                loaded or last stored with, "updated_at" is not taken into account.
+        """
+        stored_data = model._stored_data
+        if not (model.exist and stored_data) or len(stored_data) != len(clean_value):
+            return False
+        for name, value in clean_value.items():
+            if name != 'updated_at' and stored_data.get(name, KeyError) != value:
+                return False
+        return True
+
+    def _store_model(self, model, clean_value, meta_data=None, index_fields=None,
+                     blind_write=False):
+        """
+        Stores serialized data of the model, writes its version and log records.
+
+        Existing objects are stored with the vclock they are loaded with,
+        they are read from riak only if it's not known and blind_write is not set.
+        New objects with a natural key are stored only if their key is still free.
+
+        Args:
+            model (instance): Model instance.
+            clean_value (dict): Serialized data of the model.
+            meta_data (dict): JSON serializable meta data for logging of save operation.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+            blind_write (bool): See :meth:`save_model`.
+
+        Returns:
+            Model instance.
+
+        Raises:
+            IntegrityError: If an object with the natural key of a new object
+                is stored after its key is checked.
+        """
         if not model.exist:
             obj = self.bucket.new(data=clean_value).store()
             model.key = obj.key
             new_obj = True
+        elif model._create_with_key:
+            obj = self.bucket.new(model.key, data=clean_value)
+            try:
+                obj.store(if_none_match=True)
+            except riak.RiakError as err:
+                if 'match_found' not in str(err) and '412' not in str(err):
+                    raise
+                raise IntegrityError("Natural key mismatch: %s for %s already exists" % (
+                    model.key, self._model_class.__name__))
+            model.setattr('_create_with_key', False)
+            new_obj = True
         else:
             new_obj = False
-            obj = self.bucket.get(model.key)
-            obj.data = clean_value
+            if model._vclock is not None or blind_write:
+                obj = self.bucket.new(model.key, data=clean_value)
+                obj.vclock = model._vclock
+            else:
+                obj = self.bucket.get(model.key)
+                obj.data = clean_value
             obj.store()
+        model.setattrs(_vclock=obj.vclock, _stored_data=clean_value)
 
         if settings.ENABLE_VERSIONS:
-            version_key = self._write_version(clean_value, model)
+            version_key = self._write_version(clean_value, model.key)
         else:
             version_key = ''
 
         if settings.ENABLE_CACHING:
             self.set_to_cache((clean_value, model.key))
+            local_cache.publish_invalidation(model.key)
 
         meta_data = meta_data or model.save_meta_data
         if settings.ENABLE_ACTIVITY_LOGGING and meta_data:
             self._write_log(version_key, meta_data, index_fields)
 
-        if self.COLLECT_SAVES and self.COLLECT_SAVES_FOR_MODEL == model.__class__.__name__:
-            self.block_saved_keys.append(obj.key)
         if settings.DEBUG:
             if new_obj:
                 sys.PYOKO_STAT_COUNTER['save'] += 1
@@ -482,6 +1180,7 @@ class Adapter(BaseAdapter):
 
         try:
             cache.set(k, json.dumps(v), settings.CACHE_EXPIRE_DURATION)
+            local_cache.put(k, v)
         except Exception as e:
             pass
             # todo should add log.error()
@@ -490,19 +1189,100 @@ class Adapter(BaseAdapter):
     @staticmethod
     def get_from_cache(key):
         """
+        Looks up the local tier first, then redis.
+
         Args:
             key (str):
         Return:
-            (dict): from json string
+            (tuple): value (dict), key (string) or None if not found.
         """
-
+        value = local_cache.get(key)
+        if value is not None:
+            return value, key
         try:
             value = cache.get(key)
-            return json.loads(value), key if value else None
+            if not value:
+                return None
+            value = json.loads(value)
+            local_cache.put(key, value)
+            return value, key
         except Exception as e:
             # todo should add log.error()
             return None
 
+    @staticmethod
+    def multi_get_from_cache(key_list_tuple):
+        """
+        Looks up given keys in the local tier, then the rest
+        in redis with a single MGET.
+
+        Args:
+            key_list_tuple(list of tuples): [('bucket_type','bucket','riak_key')]
+
+        Return:
+            tuple: list of (key, value) tuples found in the cache,
+                list of the key tuples that are not found.
+        """
+        objs, remote = [], []
+        for key_tuple in key_list_tuple:
+            value = local_cache.get(key_tuple[2])
+            if value is not None:
+                objs.append((key_tuple[2], value))
+            else:
+                remote.append(key_tuple)
+        if not remote:
+            return objs, []
+        try:
+            values = cache.mget([key for _, _, key in remote])
+        except Exception as e:
+            # todo should add log.error()
+            return objs, remote
+        misses = []
+        for key_tuple, value in zip(remote, values):
+            if value:
+                value = json.loads(value)
+                local_cache.put(key_tuple[2], value)
+                objs.append((key_tuple[2], value))
+            else:
+                misses.append(key_tuple)
+        return objs, misses
+
+    @staticmethod
+    def multi_set_to_cache(objs):
+        """
+        Writes given objects to the cache with a single pipelined batch.
+
+        Args:
+            objs (list): (key, value) tuples as returned from riak_multi_get,
+                error tuples are skipped.
+        """
+        pipe = cache.pipeline(transaction=False)
+        for obj in objs:
+            if len(obj) == 2:
+                pipe.set(obj[0], json.dumps(obj[1]), ex=settings.CACHE_EXPIRE_DURATION)
+                local_cache.put(obj[0], obj[1])
+        try:
+            pipe.execute()
+        except Exception as e:
+            pass
+            # todo should add log.error()
+
+    @staticmethod
+    def multi_delete_from_cache(keys):
+        """
+        Removes given keys from redis with a single DEL
+        and from the local tier of all processes.
+
+        Args:
+            keys (list): riak keys
+        """
+        try:
+            cache.delete(*keys)
+        except Exception as e:
+            pass
+            # todo should add log.error()
+        local_cache.invalidate(*keys)
+
     def _get_from_riak(self, key):
         """
         Args:
@@ -514,6 +1294,8 @@ class Adapter(BaseAdapter):
         obj = self.bucket.get(key)
 
         if obj.exists:
+            if self.vclocks is not None:
+                self.vclocks[obj.key] = obj.vclock
             return obj.data, obj.key
 
         raise ObjectDoesNotExist("%s %s" % (key, self.compiled_query))
@@ -544,6 +1326,9 @@ class Adapter(BaseAdapter):
                 return self._get_from_riak(key)
 
         else:
+            overlay_filters = self._overlay_filters()
+            if overlay_filters is not None:
+                return self._get_with_overlay(*overlay_filters)
             self._exec_query()
             if not self._solr_cache['docs']:
                 raise ObjectDoesNotExist("%s %s" % (self.index_name, self.compiled_query))
@@ -555,6 +1340,30 @@ class Adapter(BaseAdapter):
 
             return self._get_from_riak(self._solr_cache['docs'][0]['_yz_rk'])
 
+    def _get_with_overlay(self, writes, filters):
+        """
+        Same as :meth:`get` without a key, but results are merged with the
+        writes of the current write overlay, see :meth:`_merge_overlay`.
+
+        Only written objects can be dropped from solr results, so fetching
+        two more results than the number of writes is enough to tell if
+        there are multiple objects.
+
+        Returns:
+            (tuple): obj data dict, obj key
+        """
+        key_list, _ = self._fetch_page(0, len(writes) + 2)
+        page = [(obj[1], obj[0]) for obj in self.riak_multi_get(key_list) if len(obj) == 2]
+        results = [row for rows in self._merge_overlay([page], writes, filters)
+                   for row in rows]
+        if not results:
+            raise ObjectDoesNotExist("%s %s" % (self.index_name, self.compiled_query))
+        if len(results) > 1:
+            raise MultipleObjectsReturned(
+                "%s objects returned for %s" % (self.count(),
+                                                self._model_class.__name__))
+        return results[0]
+
     def count(self):
         """Counts the number of results that could be accessed with the current parameters.
 
@@ -563,12 +1372,49 @@ class Adapter(BaseAdapter):
         """
         # Save the existing rows and start parameters to see how many results were actually expected
         _rows = self._solr_params.get('rows', None)
-        _start = self._solr_params.get('start', 0)
+        overlay_filters = self._overlay_filters()
         if not self._solr_cache:
             # Get the count for everything
             self.set_params(rows=0)
             self._exec_query()
-        number = self._solr_cache.get('num_found', -1)
+        count = self._accessible_count(self._solr_cache.get('num_found', -1), _rows)
+        if overlay_filters is not None:
+            count += self._overlay_count_delta(*overlay_filters)
+        return count
+
+    def _overlay_count_delta(self, writes, filters):
+        """
+        Finds which written objects are counted by solr with "key__in"
+        queries of visibility.BATCH_SIZE keys, then compares them with
+        the local results.
+
+        Returns:
+            int: Number of results that should be added to the count of solr.
+        """
+        keys = list(writes)
+        indexed = set()
+        for i in range(0, len(keys), visibility.BATCH_SIZE):
+            chunk = keys[i:i + visibility.BATCH_SIZE]
+            clone = self._clone()
+            clone.add_query([('key__in', chunk)])
+            key_list, num_found = clone._fetch_page(0, len(chunk))
+            indexed.update(key for bucket_type, bucket_name, key in key_list)
+        matching = set(key for key, data in writes.items()
+                       if self._matches_locally(filters, data, key))
+        return len(matching - indexed) - len(indexed - matching)
+
+    def _accessible_count(self, number, _rows=None):
+        """
+        Args:
+            number (int): "num_found" of the solr response
+            _rows (int): rows parameter of the query, defaults to current one.
+
+        Returns:
+            int: number of results accessible with current start and rows parameters.
+        """
+        _start = self._solr_params.get('start', 0)
+        if _rows is None:
+            _rows = self._solr_params.get('rows', None)
 
         # If start value is bigger or equal than solr results' count, should return 0
         # If there are 10 results, but if start value is specified as 30, should return 0.
@@ -650,7 +1496,30 @@ class Adapter(BaseAdapter):
         self._solr_params.update(params)
 
     def add_query(self, filters):
-        self._solr_query.extend([f if len(f) == 3 else (f[0], f[1], False) for f in filters])
+        self._solr_query += tuple(f if len(f) == 3 else (f[0], f[1], False) for f in filters)
+
+    def add_or_query(self, filter_groups):
+        """
+        Adds a query part which matches any of the given filter groups.
+
+        Args:
+            filter_groups (list): Dicts of query filters,
+                filters of a group are joined with AND.
+        """
+        if not filter_groups:
+            raise ValueError("filter groups can not be empty for OR query")
+        solr_query, want_deleted = self._solr_query, self.want_deleted
+        clauses = []
+        try:
+            for filters in filter_groups:
+                self._solr_query = ()
+                self.add_query(filters.items())
+                # deleted records are filtered out once, by the whole query
+                self.want_deleted = True
+                clauses.append('(%s)' % self._build_query())
+        finally:
+            self._solr_query, self.want_deleted = solr_query, want_deleted
+        self.add_query([('NOKEY', ' OR '.join(clauses), True)])
 
     def _escape_query(self, query, escaped=False):
         """
@@ -665,11 +1534,7 @@ class Adapter(BaseAdapter):
         """
         if escaped:
             return query
-        query = six.text_type(query)
-        for e in ['+', '-', '&&', '||', '!', '(', ')', '{', '}', '[', ']', '^', '"', '~', '*',
-                  '?', ':', ' ']:
-            query = query.replace(e, "\\%s" % e)
-        return query
+        return SOLR_ESCAPE_RE.sub(r'\\\1', six.text_type(query))
 
     def _parse_query_modifier(self, modifier, qval, is_escaped):
         """
@@ -815,6 +1680,15 @@ class Adapter(BaseAdapter):
         """
         Builds SOLR query and stores it into self.compiled_query
         """
+        self.compiled_query = self._build_query()
+
+    def _build_query(self):
+        """
+        Builds SOLR query from self._solr_query
+
+        Returns:
+            str: compiled query.
+        """
         # https://wiki.apache.org/solr/SolrQuerySyntax
         # http://lucene.apache.org/core/2_9_4/queryparsersyntax.html
         query = []
@@ -894,7 +1768,7 @@ class Adapter(BaseAdapter):
                 joined_query = '-deleted:True'
         elif not joined_query:
             joined_query = '*:*'
-        self.compiled_query = joined_query
+        return joined_query
 
     def _sort_to_str(self):
         """
@@ -909,10 +1783,24 @@ class Adapter(BaseAdapter):
             "name asc, timestamp desc"
         """
 
+        self._solr_params['sort'] = self._sort_params_to_str(self._solr_params['sort'])
+
+    @staticmethod
+    def _sort_params_to_str(sort):
+        """
+        Args:
+            sort (OrderedDict | str): sort parameters, already converted ones returned as is.
+
+        Returns:
+            str: solr sort parameter. timestamp is always the last one.
+        """
+        if isinstance(sort, six.string_types):
+            return sort
+
         params_list = []
         timestamp = ""
 
-        for k, v in self._solr_params['sort'].items():
+        for k, v in sort.items():
             if k != "timestamp":
                 params_list.append(" ".join([k, v]))
             else:
@@ -920,7 +1808,7 @@ class Adapter(BaseAdapter):
 
         params_list.append(" ".join(['timestamp', timestamp]))
 
-        self._solr_params['sort'] = ", ".join(params_list)
+        return ", ".join(params_list)
 
     def _process_params(self):
         """
@@ -948,6 +1836,60 @@ class Adapter(BaseAdapter):
             'BUCKET': self.index_name,
             'QUERY_PARAMS': self._solr_params}))
 
+    def _exec_cursor_query(self, cursor_mark, rows):
+        """
+        Executes the query with solr's cursorMark parameter.
+
+        Riak client's search method drops "nextCursorMark" from the
+        solr response, so like :meth:`riak_http_search_query` we
+        talk to Riak's HTTP search endpoint directly, over the kept
+        connection of current thread (see :func:`pyoko.db.connection.http_get`).
+
+        Cursors require a sort on the uniqueKey of the index, so "_yz_id"
+        is appended as the tie-breaker of current sort parameters. Other
+        solr parameters (e.g. "fq", "defType") are sent as is, except
+        "start", which can't be used with cursors.
+
+        Args:
+            cursor_mark (str): "*" for the first page, "nextCursorMark"
+                of the previous response for the others.
+            rows (int): number of documents to be fetched.
+
+        Returns:
+            tuple: (docs, num_found, next_cursor_mark)
+        """
+        if not self.compiled_query:
+            self._compile_query()
+        solr_params = dict((k, v) for k, v in self._solr_params.items() if k != 'start')
+        solr_params.update({
+            'q': self.compiled_query,
+            'wt': 'json',
+            'fl': '_yz_rk',
+            'rows': rows,
+            'sort': "%s, _yz_id asc" % self._sort_params_to_str(self._solr_params['sort']),
+            'cursorMark': cursor_mark,
+        })
+        if six.PY2:
+            solr_params = dict((k, v.encode('UTF-8') if isinstance(v, six.text_type) else v)
+                               for k, v in solr_params.items())
+        search_path = "/search/query/%s?%s" % (self.index_name, urlencode(solr_params, True))
+        if settings.DEBUG and settings.DEBUG_LEVEL >= 5:
+            print("CURSOR QRY => %s" % search_path)
+        try:
+            status, body = http_get(search_path)
+            if status != 200:
+                raise riak.RiakError("Cursor query failed with status %s: %s" % (
+                    status, bytes_to_str(body)))
+            result = json.loads(bytes_to_str(body))
+            return (result['response']['docs'],
+                    result['response']['numFound'],
+                    result['nextCursorMark'])
+        except riak.RiakError as err:
+            err.value += self._get_debug_data()
+            raise
+        except (http_client.HTTPException, IOError, ValueError, KeyError) as err:
+            raise riak.RiakError("Cursor query failed: %r%s" % (err, self._get_debug_data()))
+
     def _exec_query(self):
         """
         Executes solr query if it hasn't already executed.
@@ -8,11 +8,16 @@ riak client configuration
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 
+import atexit
+import os
+import socket
 import riak
-import json
+from six.moves import http_client
+from threading import Lock, Thread, local
+import concurrent.futures as con
 from pyoko.conf import settings
 from riak.client.multi import MultiGetPool
-from riak.client.multi import Empty
+from riak.client.multi import Empty, Queue
 from redis import Redis
 
 redis_host, redis_port = settings.REDIS_SERVER.split(':')
@@ -34,6 +39,35 @@ class NotFound(Exception):
 
 
 class PyokoMG(MultiGetPool):
+    def __init__(self, size=None, queue_size=None):
+        """
+        Args:
+            size (int): number of worker threads, defaults to MULTIGET_POOL_SIZE
+            queue_size (int): max number of waiting tasks, defaults to
+                MULTIGET_QUEUE_SIZE. Enqueuing blocks when queue is full.
+        """
+        super(PyokoMG, self).__init__(size=size or int(settings.MULTIGET_POOL_SIZE))
+        self._inq = Queue(queue_size if queue_size is not None
+                          else int(settings.MULTIGET_QUEUE_SIZE))
+
+    def start(self):
+        """
+        Same as MultiPool.start() but workers are daemon threads,
+        so they can not block interpreter exit, see :func:`shutdown_pools`.
+        """
+        if not self._started.is_set():
+            if self._lock.acquire(False):
+                for i in range(self._size):
+                    worker = Thread(target=self._worker_method,
+                                    name="pyoko.multi-worker-%s-%s" % (self._name, i))
+                    worker.daemon = True
+                    worker.start()
+                    self._workers.append(worker)
+                self._started.set()
+                self._lock.release()
+            else:
+                self._started.wait()
+
     def _worker_method(self):
         """
         The body of the multi-get worker. Loops until
@@ -52,30 +86,23 @@ class PyokoMG(MultiGetPool):
             except Empty:
                 continue
 
+            # Cache lookups and writes are done for the whole key list
+            # by the caller, see Adapter.riak_multi_get.
             try:
-                # If data is found in cache this data is used.
-                # Else, data is taken from riak and set to cache.
-                if settings.ENABLE_CACHING:
-                    obj_data = cache.get(task.key)
-                    if obj_data:
-                        task.outq.put((task.key, json.loads(obj_data)))
-                        raise FoundInCache()
-
                 btype = task.client.bucket_type(task.bucket_type)
                 obj = btype.bucket(task.bucket).get(task.key, **task.options)
 
                 if not obj.exists:
+                    # multiget waits for a result for each key,
+                    # so missing objects are reported as errors.
                     raise NotFound()
 
-                if settings.ENABLE_CACHING:
-                    cache.set(task.key, json.dumps(obj.data), settings.CACHE_EXPIRE_DURATION)
-
-                task.outq.put((task.key, obj.data))
+                # vclock is kept to store the object without reading it again,
+                # see Adapter._strip_vclocks
+                task.outq.put((task.key, obj.data, obj.vclock))
 
             except KeyboardInterrupt:
                 raise
-            except FoundInCache or NotFound:
-                pass
             except Exception as err:
                 errdata = (task.bucket_type, task.bucket, task.key, err)
                 task.outq.put(errdata)
@@ -87,4 +114,97 @@ log_bucket = client.bucket_type(
     settings.VERSION_LOG_BUCKET_TYPE).bucket(settings.ACTIVITY_LOGGING_BUCKET)
 
 version_bucket = client.bucket_type(
-    settings.VERSION_LOG_BUCKET_TYPE).bucket(settings.VERSION_BUCKET)
\ No newline at end of file
+    settings.VERSION_LOG_BUCKET_TYPE).bucket(settings.VERSION_BUCKET)
+
+
+_pool_lock = Lock()
+_pools = {'pid': None, 'multiget': None, 'executor': None}
+
+
+def _check_pid():
+    # threads do not survive a fork, pools of the parent process can't be used
+    if _pools['pid'] != os.getpid():
+        _pools.update({'pid': os.getpid(), 'multiget': None, 'executor': None})
+
+
+def get_multiget_pool():
+    """
+    Returns the process-wide, long-lived multiget worker pool.
+    Its size caps the number of concurrent riak fetches of the process.
+    """
+    with _pool_lock:
+        _check_pid()
+        if _pools['multiget'] is None:
+            _pools['multiget'] = PyokoMG()
+            _pools['multiget'].start()
+        return _pools['multiget']
+
+
+def get_executor():
+    """
+    Returns the process-wide thread pool executor that runs
+    solr page fetches and multigets of querysets.
+    """
+    with _pool_lock:
+        _check_pid()
+        if _pools['executor'] is None:
+            _pools['executor'] = con.ThreadPoolExecutor(
+                max_workers=int(settings.EXECUTOR_POOL_SIZE))
+        return _pools['executor']
+
+
+_http_local = local()
+
+
+def get_http_connection():
+    """
+    Returns the keep-alive connection of current thread to riak's HTTP
+    interface. It's used for requests that riak client doesn't support,
+    such as solr cursor queries.
+    """
+    if getattr(_http_local, 'pid', None) != os.getpid():
+        _http_local.conn = None
+        _http_local.pid = os.getpid()
+    if _http_local.conn is None:
+        _http_local.conn = http_client.HTTPConnection(settings.RIAK_SERVER,
+                                                      int(settings.RIAK_HTTP_PORT))
+    return _http_local.conn
+
+
+def http_get(path):
+    """
+    Sends a GET request to riak's HTTP interface over the connection of
+    current thread. Reconnects once if the connection is closed by riak.
+
+    Args:
+        path (str): Request path with its query string.
+
+    Returns:
+        tuple: (status, body) of the response.
+    """
+    for retry in (True, False):
+        conn = get_http_connection()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http_client.HTTPException, socket.error):
+            conn.close()
+            _http_local.conn = None
+            if not retry:
+                raise
+
+
+@atexit.register
+def shutdown_pools():
+    """
+    Stops shared pools, lets idle workers exit cleanly.
+    """
+    with _pool_lock:
+        if _pools['pid'] != os.getpid():
+            return
+        if _pools['multiget'] is not None:
+            _pools['multiget'].stop()
+        if _pools['executor'] is not None:
+            _pools['executor'].shutdown(wait=True)
+        _pools.update({'multiget': None, 'executor': None})
@@ -0,0 +1,146 @@
+# -*-  coding: utf-8 -*-
+"""
+In-process cache tier that sits in front of redis.
+
+Hot objects are served from a bounded, TTL limited LRU without a network
+hop or json decoding. Saves and deletes evict the keys locally and publish
+them to the invalidation channel, so sibling processes evict them too.
+
+Only active when both ENABLE_CACHING and ENABLE_LOCAL_CACHE are set.
+Values are copied when they are put and read, so callers can modify them.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import copy
+import json
+import os
+import time
+from threading import Lock, Thread
+from uuid import uuid4
+
+from pyoko.conf import settings
+from pyoko.db.connection import cache
+from pyoko.lib.utils import LRUCache, ub_to_str
+
+_lru = LRUCache(int(settings.LOCAL_CACHE_SIZE))
+_lock = Lock()
+_state = {'pid': None, 'origin': None}
+
+
+def is_enabled():
+    return settings.ENABLE_CACHING and settings.ENABLE_LOCAL_CACHE
+
+
+def _listen(origin):
+    """
+    Body of the invalidation listener thread. Evicts keys published by
+    other processes. Local tier is cleared whenever the subscription is
+    lost, since invalidations may be missed meanwhile.
+    """
+    while _state['origin'] == origin:
+        try:
+            pubsub = cache.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(settings.CACHE_INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                data = json.loads(ub_to_str(message['data']))
+                if data['origin'] != origin:
+                    for key in data['keys']:
+                        _lru.pop(key)
+        except Exception:
+            # todo should add log.error()
+            _lru.clear()
+            time.sleep(1)
+
+
+def _ensure_listener():
+    """
+    Starts the invalidation listener of the process, if not already started.
+    Threads do not survive a fork, so a new one is started in child processes.
+    """
+    if _state['pid'] == os.getpid():
+        return
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        _lru.clear()
+        _state.update({'pid': os.getpid(), 'origin': uuid4().hex})
+        listener = Thread(target=_listen, args=(_state['origin'],),
+                          name="pyoko.cache-invalidation-listener")
+        listener.daemon = True
+        listener.start()
+
+
+def get(key):
+    """
+    Args:
+        key (str): riak key
+
+    Returns:
+        A copy of the cached data of the key, None if it's not cached or expired.
+    """
+    if not is_enabled():
+        return None
+    _ensure_listener()
+    item = _lru.get(key)
+    if item is None:
+        return None
+    expires_at, value = item
+    if expires_at < time.time():
+        _lru.pop(key)
+        return None
+    return copy.deepcopy(value)
+
+
+def put(key, value):
+    """
+    Args:
+        key (str): riak key
+        value (dict): data of the object
+    """
+    if is_enabled():
+        _ensure_listener()
+        _lru.set(key, (time.time() + float(settings.LOCAL_CACHE_TTL), copy.deepcopy(value)))
+
+
+def publish_invalidation(*keys):
+    """
+    Publishes given keys to the invalidation channel,
+    other processes evict them from their local tier.
+
+    Args:
+        *keys (str): riak keys
+    """
+    if not (keys and is_enabled()):
+        return
+    _ensure_listener()
+    try:
+        cache.publish(settings.CACHE_INVALIDATION_CHANNEL,
+                      json.dumps({'origin': _state['origin'], 'keys': keys}))
+    except Exception:
+        pass
+        # todo should add log.error()
+
+
+def invalidate(*keys):
+    """
+    Evicts given keys from the local tier of all processes.
+
+    Args:
+        *keys (str): riak keys
+    """
+    for key in keys:
+        _lru.pop(key)
+    publish_invalidation(*keys)
+
+
+def info():
+    """
+    Returns:
+        dict: hits, misses and size of the local tier.
+    """
+    return _lru.info()
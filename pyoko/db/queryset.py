@@ -8,15 +8,20 @@ this module contains a base class for other db access classes
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 from collections import defaultdict
-import copy
+from datetime import datetime
 from enum import Enum
 from .adapter.db_riak import Adapter
-from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
+from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, PyokoError
 import sys
-from pyoko.lib.utils import ub_to_str
+import time
+from pyoko.lib.utils import ub_to_str, un_camel, un_camel_id
 
 ReturnType = Enum('ReturnType', 'Object Model')
 
+# max number of keys in a single "__in" query of prefetch_related and
+# relation cleanup of fast delete, kept well below the maxBooleanClauses limit of solr
+PREFETCH_CHUNK_SIZE = 200
+
 sys.PYOKO_STAT_COUNTER = {
     "save": 0,
     "update": 0,
@@ -51,6 +56,12 @@ class QuerySet(object):
         # Keeps track of previous slice to allow indexing into a slice
         self._start = None
         self._rows = None
+        # number of results, memoized on clones by count() and iteration
+        self._result_count = None
+        # first page query of the results, fetched by count() of clones
+        self._first_page = None
+        # results populated by prefetch_related() of another queryset
+        self._prefetched = None
 
     # ######## Development Methods  #########
 
@@ -85,16 +96,142 @@ class QuerySet(object):
         return self.adapter.distinct_values_of(field)
 
     def __iter__(self):
-        clone = copy.deepcopy(self)
-        for data, key in clone.adapter:
-            yield (
-                clone._make_model(data, key) if self._cfg['rtype'] == ReturnType.Model else (data, key))
+        if self._prefetched is not None:
+            for model in self._prefetched:
+                yield model
+            return
+        clone = self._clone()
+        clone.adapter.first_page = self._first_page
+        if self._cfg['rtype'] != ReturnType.Model:
+            rows = clone.adapter
+        elif clone._cfg.get('select_related') or clone._cfg.get('prefetch_related'):
+            clone.adapter.vclocks = {}
+            rows = clone._iter_with_related()
+        else:
+            clone.adapter.vclocks = {}
+            rows = (clone._make_model(data, key) for data, key in clone.adapter)
+        for row in rows:
+            self._remember_count(clone.adapter.result_count)
+            yield row
+        self._remember_count(clone.adapter.result_count)
 
     def __len__(self):
-        return copy.deepcopy(self).adapter.count()
+        return self.count()
+
+    def _iter_with_related(self):
+        """
+        Creates model instances page by page and resolves
+        their related objects before yielding them.
+
+        Yields:
+            Model instances.
+        """
+        for page in self.adapter.iter_pages():
+            models = [self._make_model(data, key) for data, key in page]
+            if self._cfg.get('select_related'):
+                self._select_related_page(models)
+            if self._cfg.get('prefetch_related'):
+                self._prefetch_related_page(models)
+            for model in models:
+                yield model
+
+    def _select_related_page(self, models):
+        """
+        Fetches linked models given to :meth:`select_related` with one
+        multiget per linked model and attaches them to the model instances.
+
+        Missing or deleted ones are left to the lazy loader.
+
+        Args:
+            models (list): model instances of a page.
+        """
+        for field in self._cfg['select_related']:
+            lnk = self._model_class.get_links(field=field, is_set=False)[0]
+            id_field = un_camel_id(field)
+            keys = set(model._data.get(id_field) for model in models)
+            keys.discard(None)
+            keys.discard('')
+            if not keys:
+                continue
+            objects = lnk['mdl'](self._current_context).objects
+            adapter = objects.adapter
+            found = dict(obj for obj in adapter.riak_multi_get(
+                [(adapter._cfg['bucket_type'], adapter._cfg['bucket_name'], key)
+                 for key in keys]) if len(obj) == 2)
+            for model in models:
+                data = found.get(model._data.get(id_field))
+                if data is None or data.get('deleted'):
+                    continue
+                model._set_link(field, objects._make_model(data, model._data[id_field]))
+
+    def _prefetch_related_page(self, models):
+        """
+        Runs one query for each set given to :meth:`prefetch_related` over the
+        keys of the model instances of a page, groups the results by their
+        link to the instances and hands each instance an already populated set.
+
+        Args:
+            models (list): model instances of a page.
+        """
+        parents = dict((model.key, model) for model in models)
+        if not parents:
+            return
+        parent_keys = list(parents)
+        for name in self._cfg['prefetch_related']:
+            mdl, remote_name = self._model_class._nodes[name]._get_remote_link(
+                self._model_class)
+            children = defaultdict(list)
+            by_key = {}
+            for i in range(0, len(parent_keys), PREFETCH_CHUNK_SIZE):
+                chunk = parent_keys[i:i + PREFETCH_CHUNK_SIZE]
+                for child in mdl.objects.all(**{'%s__in' % remote_name: chunk}):
+                    if child.key in by_key:
+                        # refers to parents of more than one chunk
+                        continue
+                    by_key[child.key] = child
+                    for parent_key in set(self._link_ids(child._data, remote_name)):
+                        if parent_key in parents:
+                            children[parent_key].append(child)
+            for key, model in parents.items():
+                node = getattr(model, name)
+                node.objects._prefetched = children[key]
+                node.objects._result_count = len(children[key])
+                # also attach the fetched instances to list node items
+                field = node.get_links()[0]['field']
+                for item in node:
+                    child = by_key.get(getattr(item, field).key)
+                    if child is not None:
+                        item.setattr(field, child)
+
+    @staticmethod
+    def _link_ids(data, remote_name):
+        """
+        Args:
+            data (dict): model data
+            remote_name (str): link id field, "node_name.field_id" for list nodes.
+
+        Returns:
+            list: keys that the model data refers with the given field.
+        """
+        if '.' in remote_name:
+            node_name, field = remote_name.split('.', 1)
+            return [item.get(field) for item in data.get(node_name) or []]
+        return [data.get(remote_name)]
+
+    def _remember_count(self, count):
+        """
+        Memoizes the number of results of a cloned queryset.
+        Root querysets (Model.objects) are not memoized,
+        they are expected to reflect latest state of the db.
+
+        Args:
+            count (int): number of results, None if not known yet.
+        """
+        if self.is_clone and count is not None:
+            self._result_count = count
 
     def __getitem__(self, index):
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         if isinstance(index, int):
             # Adjust the index if a slice was defined previously
             adjusted_index = index + (self._start or 0)
@@ -126,23 +263,33 @@ class QuerySet(object):
         else:
             raise TypeError("index must be int or slice")
 
-    def __deepcopy__(self, memo=None):
+    def _clone(self):
         """
-        A deep copy method that doesn't populate caches
-        and shares Riak client and bucket
+        Copy-on-write clone of the queryset. Only the config dict is copied,
+        adapter is cloned with :meth:`Adapter._clone`, which shares the riak
+        client, buckets and already applied query parts.
+
+        Returns:
+            QuerySet clone.
         """
-        obj = self.__class__(**self._cfg)
-        for k, v in self.__dict__.items():
-            if k.endswith(('current_context', 'model', 'model_class')):
-                obj.__dict__[k] = v
-            elif k == '_cfg':
-                obj._cfg = v.copy()
-            else:
-                obj.__dict__[k] = copy.deepcopy(v, memo)
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj._cfg = self._cfg.copy()
+        obj.adapter = self.adapter._clone()
         obj.is_clone = True
+        obj._result_count = None
+        obj._first_page = None
+        obj._prefetched = None
         return obj
 
-    def save_model(self, model, meta_data=None, index_fields=None):
+    def __deepcopy__(self, memo=None):
+        """
+        Kept for backwards compatibility, see :meth:`_clone`.
+        """
+        return self._clone()
+
+    def save_model(self, model, meta_data=None, index_fields=None, blind_write=False, force=False,
+                   clean_value=None):
         """
         saves the model instance to riak
 
@@ -151,9 +298,63 @@ class QuerySet(object):
                 {'lorem': 'ipsum', 'dolar': 5}
             index_fields (list): Tuple list for secondary indexing keys in riak (with 'bin' or 'int').
                 [('lorem','bin'),('dolar','int')]
+            blind_write (bool): See :meth:`Adapter.save_model`.
+            force (bool): See :meth:`Adapter.save_model`.
+            clean_value (dict): See :meth:`Adapter.save_model`.
         :return:
         """
-        return self.adapter.save_model(model, meta_data, index_fields)
+        return self.adapter.save_model(model, meta_data, index_fields, blind_write, force,
+                                       clean_value)
+
+    def bulk_save(self, instances, concurrency=None, hooks=True, meta=None, index_fields=None,
+                  blind_write=False, force=False):
+        """
+        Saves given model instances in bulk. Pre save steps run for all of them,
+        then they are serialized and stored concurrently, see
+        :meth:`Adapter.bulk_save_models`. Post save steps run after the stores.
+
+        Args:
+            instances (list): Model instances of this queryset's model.
+            concurrency (int): Number of concurrent stores, defaults to BULK_SAVE_CONCURRENCY.
+            hooks (bool): False to skip on_save, pre_save, post_save,
+                pre_creation and post_creation hooks of the instances.
+            meta (dict): JSON serializable meta data for logging of save operations.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+            blind_write (bool): See :meth:`Adapter.save_model`.
+            force (bool): See :meth:`Adapter.save_model`.
+
+        Returns:
+            tuple: (results, errors). Saved instances and (instance, exception)
+                tuples of the failed ones.
+
+        Examples:
+            >>> saved, failed = Person.objects.bulk_save(persons, concurrency=20)
+        """
+        prepared, errors = [], []
+        for instance in instances:
+            try:
+                prepared.append((instance,) + instance._prepare_save(hooks=hooks, force=force))
+            except Exception as e:
+                errors.append((instance, e))
+        store_errors = self.adapter.bulk_save_models([instance for instance, _, _ in prepared],
+                                                     concurrency=concurrency,
+                                                     meta_data=meta,
+                                                     index_fields=index_fields,
+                                                     blind_write=blind_write,
+                                                     force=force,
+                                                     clean_values=[clean_value for _, _, clean_value
+                                                                   in prepared])
+        results = []
+        for (instance, old_data, _), error in zip(prepared, store_errors):
+            if error is not None:
+                errors.append((instance, error))
+                continue
+            try:
+                instance._finish_save(old_data, hooks=hooks)
+                results.append(instance)
+            except Exception as e:
+                errors.append((instance, e))
+        return results, errors
 
     def _make_model(self, data, key=None):
         """
@@ -167,12 +368,18 @@ class QuerySet(object):
         """
         if data['deleted'] and not self.adapter.want_deleted:
             raise ObjectDoesNotExist('Deleted object returned')
+        key = ub_to_str(key) if key else ub_to_str(data.get('key'))
+        vclock = self.adapter.vclocks.pop(key, None) if self.adapter.vclocks else None
+        hydrator = self._model_class._get_hydrator()
+        if hydrator is not None:
+            return hydrator(data, key, self._current_context, self._pass_perm_checks, vclock)
         model = self._model_class(self._current_context,
                                   _pass_perm_checks=self._pass_perm_checks)
-
-        model.setattr('key', ub_to_str(key) if key else ub_to_str(data.get('key')))
+        model.setattrs(key=key, _vclock=vclock)
         model = model.set_data(data, from_db=True)
         model._initial_data = model.clean_value()
+        model._stored_data = model._initial_data
+        model._dirty_fields.clear()
         return model
 
     def __repr__(self):
@@ -194,6 +401,8 @@ class QuerySet(object):
         """
         Applies given query filters. If wanted result is more than specified size,
         exception is raised about using all() method instead of filter.
+        Filtering is lazy, result size is checked when the query is
+        iterated for the first time.
 
         Args:
             all_records (bool):
@@ -209,18 +418,10 @@ class QuerySet(object):
             >>> Person.objects.filter(work_unit__in=[u1, u2], name__startswith='jo')
         """
 
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.add_query(filters.items())
-        clone_length = clone.count()
-        if clone_length > self._cfg['row_size'] and not all_records:
-            raise Exception("""Your query result count(%s) is more than specified result value(%s).
-            You can narrow your filters, you can apply your own pagination or
-            you can use all() method for getting all filter results.
-            Example Usage: Unit.objects.all()
-            
-            Filters: %s  Model Class: %s 
-            """ % (clone_length, self._cfg['row_size'], filters, self._cfg['model_class']))
-
+        if not all_records:
+            clone.adapter.row_limit_filters = filters
         return clone
 
     def all(self, **filters):
@@ -288,7 +489,99 @@ class QuerySet(object):
 
         data = defaults or {}
         data.update(kwargs)
-        return self._model_class(**data).blocking_save(), True
+        obj = self._model_class(**data)
+        if self._natural_key_of(kwargs):
+            # next lookups will read it by key, no need to wait for indexing
+            return obj.save(), True
+        return obj.blocking_save(), True
+
+    def _natural_key_of(self, filters):
+        """
+        Args:
+            filters (dict): Query filters.
+
+        Returns:
+            Key of the only object that can match given filters,
+            if they are the natural key fields of the model and
+            there isn't any other filter on this queryset. None otherwise.
+        """
+        if not self.adapter._solr_query:
+            return self._model_class._natural_key_of(filters)
+
+    def get_version(self, version_key):
+        """
+        Reads a version record of an object of this model,
+        see :meth:`Adapter.read_version`.
+
+        Args:
+            version_key (str): Version_bucket key.
+
+        Returns:
+            dict: Version record, full data of the object is in "data".
+        """
+        return self.adapter.read_version(version_key)
+
+    @staticmethod
+    def _timestamp_of(value):
+        """
+        Converts a local datetime to unix timestamp, numbers are returned as is.
+        """
+        if isinstance(value, datetime):
+            return time.mktime(value.timetuple()) + value.microsecond / 1e6
+        return value
+
+    def _make_version_model(self, version_key, record):
+        """
+        Creates a model instance in the state of a version record.
+        Version key and timestamp are set as ``_version_key``
+        and ``_version_timestamp`` attributes.
+        """
+        model = self._make_model(record['data'], record['key'])
+        model.setattrs(_version_key=version_key, _version_timestamp=record['timestamp'])
+        return model
+
+    def history(self, key, start=None, end=None):
+        """
+        Iterates over the versions of an object, oldest first.
+        Version keys are streamed from riak page by page.
+
+        Args:
+            key (str): Key of the object.
+            start (datetime or float): Versions older than it are skipped.
+            end (datetime or float): Versions newer than it are skipped.
+
+        Yields:
+            Model instances in the state of each version, including deleted ones.
+
+        Example:
+            >>> for person in Person.objects.history(key):
+            >>>     print(person._version_timestamp, person.name)
+        """
+        clone = self._clone()
+        clone.adapter.want_deleted = True
+        for version_key, record in clone.adapter.iter_versions(
+                key, self._timestamp_of(start), self._timestamp_of(end)):
+            yield clone._make_version_model(version_key, record)
+
+    def as_of(self, key, timestamp):
+        """
+        Gets an object in the state it was at given time.
+
+        Args:
+            key (str): Key of the object.
+            timestamp (datetime or float): Point in time.
+
+        Returns:
+            Model instance in the state of its last version before given time.
+
+        Raises:
+            ObjectDoesNotExist: If the object had no version or it was deleted at that time.
+        """
+        last = self.adapter.last_version(key, self._timestamp_of(timestamp))
+        if last is None:
+            raise ObjectDoesNotExist("%s %s has no version before %s" % (
+                self._model_class.__name__, key, timestamp))
+        return self._make_version_model(*last)
 
     def get_or_none(self, **kwargs):
         """
@@ -332,7 +625,8 @@ class QuerySet(object):
 
             Unlike RDBMS systems, this method makes individual save calls
             to backend DB store. So this is exists as more of a comfortable
-            utility method and not a performance enhancement.
+            utility method and not a performance enhancement, see
+            :meth:`fast_update` for that.
 
         Keyword Args:
             \*\*kwargs: Fields with their corresponding values to be updated.
@@ -353,6 +647,58 @@ class QuerySet(object):
             model.save(internal=True)
         return no_of_updates
 
+    def fast_update(self, values, concurrency=None, versions=True, meta=None, index_fields=None):
+        """
+        Updates the matching objects by patching their stored data concurrently,
+        without creating model instances, see :meth:`Adapter.patch_objects`.
+
+        Note:
+            Only the fields and links of the model itself can be updated
+            this way. Hooks, uniqueness checks and relation updates are skipped.
+
+        Args:
+            values (dict): Fields and links with their new values.
+            concurrency (int): Number of concurrent updates.
+            versions (bool): False to skip writing version records.
+            meta (dict): JSON serializable meta data for logging of the update.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+
+        Returns:
+            Int. Number of updated objects.
+
+        Example:
+            .. code-block:: python
+
+                Entry.objects.all(status=1).fast_update({'status': 2})
+        """
+        return self.adapter.patch_objects(self._clean_update_values(values),
+                                          concurrency=concurrency,
+                                          versions=versions,
+                                          meta_data=meta,
+                                          index_fields=index_fields)
+
+    def _clean_update_values(self, values):
+        """
+        Args:
+            values (dict): Field / link names with their new values.
+
+        Returns:
+            dict: Cleaned values, keyed by their names in stored data.
+        """
+        patch = {}
+        for name, value in values.items():
+            if name in self._model_class._fields:
+                patch[un_camel(name)] = self._model_class._fields[name].clean_value(value)
+            elif self._model_class.get_links(field=name, is_set=False):
+                patch[un_camel_id(name)] = value.key if value is not None else ''
+            elif name.endswith('_id') and self._model_class.get_links(field=name[:-3],
+                                                                      is_set=False):
+                patch[name] = value or ''
+            else:
+                raise PyokoError("Only fields and links of %s can be updated with "
+                                 "fast update, not %s" % (self._model_class.__name__, name))
+        return patch
+
     def get(self, key=None, **kwargs):
         """
         Ensures that only one result is returned from DB and raises an exception otherwise.
@@ -361,27 +707,34 @@ class QuerySet(object):
             - If no argument is given, only does "ensuring about one and only object" job.
             - If key given as only argument, retrieves the object from DB.
             - if query filters given, implicitly calls filter() method.
+              If they are the natural key fields of the model (see ``Meta.natural_key``),
+              object is directly retrieved by its key instead.
 
         Raises:
             MultipleObjectsReturned: If there is more than one (1) record is returned.
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         # If we are in a slice, adjust the start and rows
         if self._start:
             clone.adapter.set_params(start=self._start)
         if self._rows:
             clone.adapter.set_params(rows=self._rows)
-        if key:
-            data, key = clone.adapter.get(key)
-        elif kwargs:
-            data, key = clone.filter(**kwargs).adapter.get()
-        else:
-            data, key = clone.adapter.get()
+        natural_key = None
+        if kwargs and not key:
+            natural_key = key = self._natural_key_of(kwargs)
+            if key is None:
+                clone = clone.filter(**kwargs)
+        vclocks = clone.adapter.vclocks = {}
+        data, key = clone.adapter.get(key)
+        if natural_key and data['deleted'] and not clone.adapter.want_deleted:
+            raise ObjectDoesNotExist("%s %s" % (self._model_class.__name__, kwargs))
         if clone._cfg['rtype'] == ReturnType.Object:
             return data, key
-        return self._make_model(data, key)
+        model = self._make_model(data, key)
+        model.setattr('_vclock', vclocks.get(key))
+        return model
 
-    def delete(self):
+    def delete(self, fast=False, concurrency=None, meta=None, index_fields=None):
         """
         Deletes all objects that matches to the queryset.
 
@@ -390,17 +743,75 @@ class QuerySet(object):
             to backend DB store. So this is exists as more of a comfortable
             utility method and not a performance enhancement.
 
+            With "fast", objects are soft deleted by patching their stored data
+            concurrently (see :meth:`fast_update`), without calling their delete hooks.
+            References to deleted objects are removed from related objects with
+            one query per relation for each page, see :meth:`_delete_relations_of`.
+
+        Args:
+            fast (bool): Bulk soft delete without creating model instances.
+            concurrency (int): Number of concurrent updates of fast delete.
+            meta (dict): JSON serializable meta data for logging of fast delete.
+            index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
+
         Returns:
             List of deleted objects or None if *confirm* not set.
+            Number of deleted objects for fast delete.
 
         Example:
             >>> Person.objects.filter(age__gte=16, name__startswith='jo').delete()
+            >>> Person.objects.all(age__lte=16).delete(fast=True)
 
         """
-        clone = copy.deepcopy(self)
+        if fast:
+            patch = self._clean_update_values({'deleted': True, 'deleted_at': datetime.now()})
+            return self.adapter.patch_objects(patch,
+                                              concurrency=concurrency,
+                                              meta_data=meta,
+                                              index_fields=index_fields,
+                                              evict_cache=True,
+                                              page_callback=self._delete_relations_of)
+        clone = self._clone()
         # clone.adapter.want_deleted = True
         return [item.delete() and item for item in clone]
 
+    def _delete_relations_of(self, keys):
+        """
+        Removes references to given deleted objects from related objects.
+        Related objects are queried per relation with chunks of keys, then
+        each of them is saved once with :meth:`bulk_save`.
+
+        Args:
+            keys (list): Keys of the deleted objects.
+        """
+        keys = set(keys)
+        key_list = list(keys)
+        for lnk in self._model_class.get_links(link_source=False):
+            field = lnk['reverse'].split('.')[0]
+            query_name = '%s_id__in' % un_camel(lnk['reverse'])
+            changed = {}
+            for i in range(0, len(key_list), PREFETCH_CHUNK_SIZE):
+                related = lnk['mdl'].objects.all(
+                    **{query_name: key_list[i:i + PREFETCH_CHUNK_SIZE]}).data()
+                for data, key in related:
+                    if data['deleted']:
+                        # just deleted, solr index is not updated yet
+                        continue
+                    # a list node can refer to keys of different chunks
+                    rel = changed.get(key) or related._make_model(data, key)
+                    lnkd_model = getattr(rel, field)
+                    if lnkd_model._TYPE == 'ListNode':
+                        list(lnkd_model)
+                        for lnk_key in keys.intersection(lnkd_model.node_dict):
+                            lnkd_model.__delitem__(lnk_key, sync=False)
+                    elif lnkd_model.key in keys:
+                        rel._set_link(field, lnkd_model.__class__())
+                    changed[key] = rel
+            if changed:
+                _, errors = lnk['mdl'].objects.bulk_save(list(changed.values()), hooks=False)
+                if errors:
+                    raise errors[0][1]
+
     def values_list(self, *args, **kwargs):
         """
         Returns list of values for given fields.
@@ -457,11 +868,13 @@ class QuerySet(object):
             results.append(data)
         return results
 
-    def or_filter(self, **filters):
+    def or_filter(self, *filter_groups, **filters):
         """
         Works like "filter" but joins given filters with OR operator.
+        Filters can also be given as groups, filters of a group are joined with AND.
 
         Args:
+            *filter_groups (dict): Groups of query filters.
             **filters: Query filters as keyword arguments.
 
         Returns:
@@ -469,10 +882,14 @@ class QuerySet(object):
 
         Example:
             >>> Person.objects.or_filter(age__gte=16, name__startswith='jo')
+            >>> Person.objects.or_filter({'name': 'John', 'surname': 'Doe'}, {'age__gte': 16})
 
         """
-        clone = copy.deepcopy(self)
-        clone.adapter.add_query([("OR_QRY", filters)])
+        clone = self._clone()
+        if filters:
+            clone.adapter.add_query([("OR_QRY", filters)])
+        if filter_groups:
+            clone.adapter.add_or_query(filter_groups)
         return clone
 
     def OR(self):
@@ -482,7 +899,7 @@ class QuerySet(object):
         Returns:
             Self. Queryset object.
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter._QUERY_GLUE = ' OR '
         return clone
 
@@ -511,17 +928,44 @@ class QuerySet(object):
             >>> Person.objects.search_on('name', 'surname', contains='john')
             >>> Person.objects.search_on('name', 'surname', startswith='jo')
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.search_on(*fields, **query)
         return clone
 
     def count(self):
         """
-        counts by executing solr query with rows=0 parameter
+        counts by executing solr query with rows=0 parameter.
+        Result is memoized on cloned querysets, iterating a queryset
+        also memoizes the count, since it's returned with the first page.
+        Cloned querysets fetch the first page of results instead, and keep it
+        for the iteration, so counting before listing doesn't cost an extra query.
+
         :return:  number of objects matches to the query
         :rtype: int
         """
-        return copy.deepcopy(self).adapter.count()
+        if self._result_count is None:
+            adapter = self._clone().adapter
+            if self.is_clone and self._can_fetch_first_page(adapter):
+                self._first_page = adapter._first_page()
+                count = adapter._accessible_count(self._first_page[1])
+            else:
+                count = adapter.count()
+            self._remember_count(count)
+            return count
+        return self._result_count
+
+    @staticmethod
+    def _can_fetch_first_page(adapter):
+        """
+        Args:
+            adapter: adapter of a cloned queryset
+
+        Returns:
+            bool: True if the first page of the results can be
+                fetched to count them and kept for the iteration.
+        """
+        return (adapter._overlay_filters() is None and
+                not (adapter.cursor and adapter._solr_params.get('start')))
 
     def _clear(self, wait=True):
         """
@@ -544,17 +988,95 @@ class QuerySet(object):
         Examples:
             >>> Person.objects.order_by('-name', 'join_date')
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.ordered = True
         if args:
             clone.adapter.order_by(*args)
         return clone
 
+    def cursor(self, page_size=None):
+        """
+        Forces cursor based pagination (solr's cursorMark) for iteration.
+        By default cursors are used automatically for results that may not fit
+        into a single page, unless a start offset is given.
+
+        Args:
+            page_size (int): Number of records fetched for each page.
+             Defaults to row_size.
+
+        Returns:
+            Self. Queryset object.
+
+        Examples:
+            >>> for person in Person.objects.all().cursor(5000):
+            ...     person.save()
+        """
+        clone = self._clone()
+        clone.adapter.cursor = True
+        if page_size:
+            clone.adapter.page_size = int(page_size)
+        return clone
+
+    def select_related(self, *fields):
+        """
+        Fetches given linked models of the results in batches while iterating,
+        with one multiget per linked model for each page of results,
+        instead of loading them one by one on first access.
+
+        Only the links of the model itself are supported,
+        links of nodes and list nodes are still loaded lazily.
+
+        Args:
+            *fields: Names of the linked model fields.
+
+        Returns:
+            Self. Queryset object.
+
+        Examples:
+            >>> for row in Lecture.objects.filter(...).select_related('lecturer', 'unit'):
+            ...     row.lecturer.name  # already fetched
+        """
+        for field in fields:
+            if not self._model_class.get_links(field=field, is_set=False):
+                raise PyokoError("%s has no linked model field named %s" % (
+                    self._model_class.__name__, field))
+        clone = self._clone()
+        clone._cfg['select_related'] = clone._cfg.get('select_related', ()) + fields
+        return clone
+
+    def prefetch_related(self, *names):
+        """
+        Populates given reverse sets / many-to-many list nodes of the results
+        while iterating, with one query for each page of results,
+        instead of querying them separately for each result.
+
+        Prefetched objects are served by "objects" of the set
+        and attached to the items of the list node.
+
+        Args:
+            *names: Names of the sets or list nodes.
+
+        Returns:
+            Self. Queryset object.
+
+        Examples:
+            >>> for unit in Unit.objects.filter(...).prefetch_related('sub_units'):
+            ...     list(unit.sub_units.objects)  # already fetched
+        """
+        for name in names:
+            node = self._model_class._nodes.get(name)
+            if getattr(node, '_TYPE', None) != 'ListNode' or not node.get_links():
+                raise PyokoError("%s has no linked list node named %s" % (
+                    self._model_class.__name__, name))
+        clone = self._clone()
+        clone._cfg['prefetch_related'] = clone._cfg.get('prefetch_related', ()) + names
+        return clone
+
     def set_params(self, **params):
         """
         add/update solr query parameters
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter.set_params(**params)
         return clone
 
@@ -562,7 +1084,7 @@ class QuerySet(object):
         """
         return (data_dict, key) tuple instead of models instances
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone._cfg['rtype'] = ReturnType.Object
         return clone
 
@@ -574,7 +1096,7 @@ class QuerySet(object):
         query (str): solr query
         \*\*params: solr parameters
         """
-        clone = copy.deepcopy(self)
+        clone = self._clone()
         clone.adapter._pre_compiled_query = query
         clone.adapter.compiled_query = query
         return clone
@@ -0,0 +1,143 @@
+# -*-  coding: utf-8 -*-
+"""
+Waits for saved or deleted objects to become visible in search results.
+
+Riak stores objects immediately, but they are searchable only after
+Yokozuna indexes them. Waiters collect the keys of the objects that
+should be waited for, then check them with batched ``key__in`` queries,
+backing off between checks until all are visible or the deadline passes.
+
+Waiters are registered per thread, so saves of other threads are never
+collected by them.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import threading
+import time
+
+from pyoko.conf import settings
+from pyoko.exceptions import PyokoError
+
+#: number of keys that are checked with a single query
+BATCH_SIZE = 100
+#: first and maximum delays between checks, in seconds
+MIN_DELAY = 0.05
+MAX_DELAY = 1.0
+BACKOFF_FACTOR = 1.5
+
+_local = threading.local()
+
+
+class IndexTimeout(PyokoError):
+    """Objects did not become visible in search results before the deadline."""
+    pass
+
+
+class VisibilityWaiter(object):
+    """
+    Waits until the objects of the given model with the collected
+    keys are matched by the given query.
+
+    Args:
+        mdl: Model class.
+        query_dict (dict): Query filters that the objects should match.
+        timeout (float): Seconds to wait at most, defaults to
+            ``settings.INDEX_VISIBILITY_TIMEOUT``.
+
+    Example:
+        .. code-block:: python
+
+            waiter = VisibilityWaiter(Student, {'deleted': True})
+            waiter.add(student.key)
+            elapsed = waiter.wait()
+    """
+
+    def __init__(self, mdl, query_dict=None, timeout=None):
+        self.mdl = mdl
+        self.query_dict = query_dict or {}
+        self.timeout = float(settings.INDEX_VISIBILITY_TIMEOUT if timeout is None else timeout)
+        self.pending = set()
+        #: seconds spent in the last wait() call
+        self.elapsed = None
+
+    def add(self, *keys):
+        """
+        Args:
+            *keys (str): Keys of the objects that should be waited for.
+        """
+        self.pending.update(keys)
+
+    def _visible_keys(self, keys):
+        """
+        Args:
+            keys (list): Keys to check, at most BATCH_SIZE of them.
+
+        Returns:
+            set: Given keys that are matched by the query.
+        """
+        adapter = self.mdl.objects.all(key__in=keys, **self.query_dict).adapter
+        key_list, num_found = adapter._fetch_page(0, len(keys))
+        return set(key for bucket_type, bucket_name, key in key_list)
+
+    def wait(self):
+        """
+        Blocks until all pending keys are visible.
+
+        Returns:
+            float: Seconds it took for the objects to be indexed.
+
+        Raises:
+            IndexTimeout: If some objects are still not visible after the timeout.
+        """
+        started_at = time.time()
+        delay = MIN_DELAY
+        while self.pending:
+            pending = list(self.pending)
+            for i in range(0, len(pending), BATCH_SIZE):
+                self.pending.difference_update(self._visible_keys(pending[i:i + BATCH_SIZE]))
+            if not self.pending:
+                break
+            if time.time() - started_at + delay > self.timeout:
+                raise IndexTimeout("%s objects of %s are not indexed in %s seconds: %s" % (
+                    len(self.pending), self.mdl.__name__, self.timeout, list(self.pending)[:10]))
+            time.sleep(delay)
+            delay = min(delay * BACKOFF_FACTOR, MAX_DELAY)
+        self.elapsed = time.time() - started_at
+        return self.elapsed
+
+    def __enter__(self):
+        """
+        Collects the keys of the objects of the model that are saved
+        in this thread, then waits for them on exit.
+        """
+        _active_waiters().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _active_waiters().remove(self)
+        if exc_type is None:
+            self.wait()
+
+
+def _active_waiters():
+    try:
+        return _local.waiters
+    except AttributeError:
+        _local.waiters = []
+        return _local.waiters
+
+
+def collect(model_name, key):
+    """
+    Adds the key of a just saved object to the waiters of current thread.
+
+    Args:
+        model_name (str): Class name of the saved object.
+        key (str): Key of the saved object.
+    """
+    for waiter in getattr(_local, 'waiters', ()):
+        if waiter.mdl.__name__ == model_name:
+            waiter.add(key)
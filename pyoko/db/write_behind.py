@@ -0,0 +1,153 @@
+# -*-  coding: utf-8 -*-
+"""
+Write-behind queue for version and activity log records.
+
+When ENABLE_WRITE_BEHIND is set, records are put on a bounded in-process
+queue with client generated keys and stored by background workers, so
+saves don't wait for them. A save waits at most WRITE_BEHIND_BLOCK_TIMEOUT
+for room in a full queue, then the record is dropped. Both are counted,
+see :func:`stats`. Pending records are written before the process exits.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import atexit
+import os
+from threading import Lock, Thread
+
+from six.moves.queue import Queue, Full, Empty
+
+from pyoko.conf import settings
+
+_lock = Lock()
+_state = {'pid': None, 'queue': None, 'workers': []}
+_stats = {'enqueued': 0, 'written': 0, 'failed': 0, 'blocked': 0, 'dropped': 0}
+
+
+def _count(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _get_queue():
+    """
+    Returns the queue of the process, starts its workers at first call.
+    Threads do not survive a fork, so child processes start their own.
+    """
+    if _state['pid'] == os.getpid():
+        return _state['queue']
+    with _lock:
+        if _state['pid'] != os.getpid():
+            queue = Queue(maxsize=int(settings.WRITE_BEHIND_QUEUE_SIZE))
+            workers = []
+            for i in range(int(settings.WRITE_BEHIND_WORKERS)):
+                worker = Thread(target=_work, args=(queue,),
+                                name="pyoko.write-behind-%s" % i)
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+            _state.update({'pid': os.getpid(), 'queue': queue, 'workers': workers})
+    return _state['queue']
+
+
+def _store(bucket, key, data, indexes, on_stored):
+    obj = bucket.new(key, data=data)
+    for index in indexes:
+        obj.add_index(*index)
+    obj.store()
+    if on_stored is not None:
+        on_stored()
+
+
+def _work(queue):
+    """
+    Body of the worker threads. Takes up to WRITE_BEHIND_BATCH_SIZE
+    records at once and stores them, exits when it takes a None.
+    """
+    while True:
+        batch = [queue.get()]
+        while batch[-1] is not None and len(batch) < settings.WRITE_BEHIND_BATCH_SIZE:
+            try:
+                batch.append(queue.get_nowait())
+            except Empty:
+                break
+        for record in batch:
+            if record is None:
+                queue.task_done()
+                return
+            try:
+                _store(*record)
+                _count('written')
+            except Exception:
+                # todo should add log.error()
+                _count('failed')
+            finally:
+                queue.task_done()
+
+
+def enqueue(bucket, key, data, indexes, on_stored=None):
+    """
+    Queues a record to be stored in background.
+
+    Args:
+        bucket: Riak bucket of the record.
+        key (str): Key of the record.
+        data (dict): Data of the record.
+        indexes (list): (index name, value) tuples of secondary indexes.
+        on_stored (callable): Called by the worker after the record is stored.
+
+    Returns:
+        bool: False if the record is dropped since queue is full.
+    """
+    queue = _get_queue()
+    record = (bucket, key, data, indexes, on_stored)
+    try:
+        queue.put_nowait(record)
+    except Full:
+        _count('blocked')
+        try:
+            queue.put(record, timeout=float(settings.WRITE_BEHIND_BLOCK_TIMEOUT))
+        except Full:
+            _count('dropped')
+            return False
+    _count('enqueued')
+    return True
+
+
+def flush():
+    """
+    Blocks until all queued records of the process are stored.
+    """
+    if _state['pid'] == os.getpid():
+        _state['queue'].join()
+
+
+@atexit.register
+def shutdown():
+    """
+    Writes pending records and stops the workers.
+    """
+    with _lock:
+        if _state['pid'] != os.getpid():
+            return
+        queue, workers = _state['queue'], _state['workers']
+        _state.update({'pid': None, 'queue': None, 'workers': []})
+    for worker in workers:
+        queue.put(None)
+    for worker in workers:
+        worker.join()
+
+
+def stats():
+    """
+    Returns:
+        dict: Number of enqueued, written, failed and dropped records, number of
+            saves that waited for room in the queue and number of pending records.
+    """
+    with _lock:
+        result = dict(_stats)
+        queue = _state['queue'] if _state['pid'] == os.getpid() else None
+    result['pending'] = queue.qsize() if queue is not None else 0
+    return result
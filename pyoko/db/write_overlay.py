@@ -0,0 +1,78 @@
+# -*-  coding: utf-8 -*-
+"""
+Read-your-writes overlay for querysets.
+
+Objects that are saved or deleted in a ``WriteOverlay`` block are recorded
+with their stored data. Querysets of the same thread merge them into their
+results, counts and get() calls, so they are seen before Yokozuna indexes
+them. This is only done for queries that can be evaluated locally, see
+:meth:`pyoko.db.adapter.db_riak.Adapter._local_filters`.
+
+.. code-block:: python
+
+    with WriteOverlay():
+        Student(name='Jack', number='42').save()
+        assert Student.objects.filter(number='42').count() == 1
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import threading
+from collections import defaultdict
+
+_local = threading.local()
+
+
+class WriteOverlay(object):
+    """
+    Records the writes of current thread in its block. Writes of nested
+    blocks are recorded by the outer ones too, queries use the innermost one.
+    """
+
+    def __init__(self):
+        #: stored data of written objects, by model name and key
+        self.writes = defaultdict(dict)
+
+    def __enter__(self):
+        _active_overlays().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _active_overlays().remove(self)
+
+
+def _active_overlays():
+    try:
+        return _local.overlays
+    except AttributeError:
+        _local.overlays = []
+        return _local.overlays
+
+
+def record(model_name, key, data):
+    """
+    Records a write to the overlays of current thread.
+
+    Args:
+        model_name (str): Class name of the written object.
+        key (str): Key of the written object.
+        data (dict): Stored data of the object.
+    """
+    for overlay in getattr(_local, 'overlays', ()):
+        overlay.writes[model_name][key] = data
+
+
+def writes_of(model_name):
+    """
+    Args:
+        model_name (str): Model class name.
+
+    Returns:
+        dict: Stored data of the objects of the model that are written in
+            the innermost overlay by their keys, None if there isn't any.
+    """
+    overlays = getattr(_local, 'overlays', None)
+    if overlays:
+        return overlays[-1].writes.get(model_name)
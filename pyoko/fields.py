@@ -71,6 +71,7 @@ class BaseField(object):
 
     def __set__(self, instance, value):
         instance._field_values[self.name] = value
+        instance._mark_dirty(self.name)
         instance._set_get_choice_display_method(self.name, self, value)
 
 
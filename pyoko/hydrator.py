@@ -0,0 +1,141 @@
+# -*-  coding: utf-8 -*-
+"""
+Creates model instances from stored data.
+
+Creating an instance with ``Model(context)`` and then loading the stored data
+into it sets every field twice, creates lazy proxies for the links twice and
+replaces the adapter of the model's queryset. A :class:`Hydrator` fills the
+instance from the stored data in a single pass instead, using the fields and
+links of the model class that are collected once.
+"""
+
+# Copyright (C) 2015 ZetaOps Inc.
+#
+# This file is licensed under the GNU General Public License v3
+# (GPLv3).  See LICENSE.txt for details.
+import copy
+import weakref
+
+from .conf import settings
+from .lib.utils import get_object_from_path, un_camel, un_camel_id
+from .node import LazyModel, linked_model_loader
+
+
+class Hydrator(object):
+    """
+    Builds instances of a model from stored data, in the same state
+    ``Model(context).set_data(data, from_db=True)`` would.
+
+    Args:
+        mdl: Model class.
+    """
+
+    def __init__(self, mdl):
+        from .model import Model
+        self.mdl = mdl
+        self.fields = [(name, fld) for name, fld in mdl._fields.items()]
+        self.links = [(lnk['field'], un_camel_id(lnk['field']), lnk['mdl'],
+                       lnk['null'], lnk['verbose'])
+                      for lnk in mdl.get_links(is_set=False)]
+        self.nodes = [(name, klass, un_camel(name)) for name, klass in mdl._nodes.items()]
+        self.choices_manager = get_object_from_path(settings.CATALOG_DATA_MANAGER)
+        self.row_level_access = mdl.row_level_access != Model.row_level_access
+
+    @staticmethod
+    def supports(mdl):
+        """
+        Models that customize their creation or loading, or that
+        have field permissions are created with their __init__.
+
+        Args:
+            mdl: Model class.
+
+        Returns:
+            bool: True if instances of the model can be built by a hydrator.
+        """
+        from .model import Model
+        from .node import Node
+        return (mdl.__init__ == Model.__init__ and
+                mdl.set_data == Model.set_data and
+                mdl._load_data == Node._load_data and
+                mdl._set_fields_values == Node._set_fields_values and
+                mdl._instantiate_linked_models == Node._instantiate_linked_models and
+                not mdl.Meta.field_permissions)
+
+    def _objects_of(self, model):
+        """
+        Sets the context of the model's queryset like Model.__init__
+        does, only when it's changed, and applies row level access.
+        """
+        objects = self.mdl.objects
+        if (objects._current_context is not model._context or
+                objects._pass_perm_checks != model._pass_perm_checks):
+            objects._pass_perm_checks = model._pass_perm_checks
+            objects.set_model(model=model)
+        if self.row_level_access:
+            return self.mdl.row_level_access(model._context, objects)
+        return objects
+
+    def __call__(self, data, key, context, pass_perm_checks=False, vclock=None):
+        """
+        Args:
+            data (dict): Stored data of the object.
+            key (str): Key of the object.
+            context: Context of the instance.
+            pass_perm_checks (bool): Pass permission checks of the instance.
+            vclock: Riak vclock of the object.
+
+        Returns:
+            Model instance. Its stored and initial data is the given dict,
+            so it shouldn't be modified afterwards.
+        """
+        model = self.mdl.__new__(self.mdl)
+        model._set_model_attrs(context, {'key': key, '_pass_perm_checks': pass_perm_checks})
+        model._set_node_attrs(choices_manager=self.choices_manager)
+        model.setattrs(
+            _initial_data=data,
+            _vclock=vclock,
+            _stored_data=data,
+            _data=data.copy(),
+        )
+        model.__dict__['objects'] = self._objects_of(model)
+        for name, klass, _name in self.nodes:
+            node = model._instantiate_node(name, klass)
+            if _name in data:
+                # list nodes modify the items of their data
+                node._load_data(copy.deepcopy(data[_name]), True)
+        for name, fld in self.fields:
+            val = data.get(name)
+            if fld.default:
+                default = fld.default() if callable(fld.default) else fld.default
+                if fld.choices is None:
+                    # Model.__init__ creates it while setting the default value
+                    model._set_get_choice_display_method(name, fld, default)
+            if val is None:
+                if name in data:
+                    # stored as null, default of the field is kept
+                    if fld.default:
+                        fld.__set__(model, default)
+                elif fld.default:
+                    val = default
+            if val is not None:
+                fld._load_data(model, val)
+            if fld.choices is not None:
+                model._choice_fields.append(name)
+                model._set_get_choice_display_method(name, fld, val)
+        for field_name, _name, mdl, null, verbose in self.links:
+            model.__dict__[_name] = ""
+            if data.get(_name) is not None:
+                obj = LazyModel(linked_model_loader(mdl, context, data[_name], null, verbose),
+                                null, verbose)
+                obj.key = data[_name]
+            else:
+                obj = LazyModel(self._empty_loader(mdl, context), null, verbose)
+            model.__dict__[field_name] = obj
+        model._dirty_fields.clear()
+        self.mdl._instance_registry.add(weakref.ref(model))
+        return model
+
+    @staticmethod
+    def _empty_loader(mdl, context):
+        return lambda: mdl(context)
@@ -12,6 +12,8 @@ import json
 import re
 import datetime
 import random
+import threading
+from collections import OrderedDict
 from time import mktime
 import importlib
 import six
@@ -78,6 +80,95 @@ else:
             return value
 
 
+class LRUCache(object):
+    """
+    Thread-safe, size bounded LRU mapping with hit / miss counters.
+
+    Args:
+        size (int): max number of items, least recently used
+            items are evicted when it's exceeded.
+    """
+    _MISSING = object()
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        """
+        Returns:
+            dict: hits, misses, current and max size of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'max_size': self.size}
+
+    def __len__(self):
+        return len(self._data)
+
+
+def dict_diff(old, new):
+    """
+    Top level difference of two dicts.
+
+    Args:
+        old (dict): Previous state.
+        new (dict): Current state.
+
+    Returns:
+        dict: {'set': {name: new value}, 'unset': [removed names]}
+    """
+    missing = object()
+    return {'set': dict((k, v) for k, v in new.items() if old.get(k, missing) != v),
+            'unset': [k for k in old if k not in new]}
+
+
+def apply_dict_diff(old, diff):
+    """
+    Args:
+        old (dict): Previous state.
+        diff (dict): Output of :func:`dict_diff`.
+
+    Returns:
+        dict: A new dict with the diff applied.
+    """
+    new = dict(old)
+    for k in diff['unset']:
+        new.pop(k, None)
+    new.update(diff['set'])
+    return new
+
+
 def un_camel(input, dash="_"):
     return UN_CAMEL_RE.sub(r'%s\1' % dash, input).lower()
 
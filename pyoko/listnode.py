@@ -69,15 +69,30 @@ class ListNode(Node):
 
     @lazy_property
     def objects(self):
-        links = self.get_links()
+        remote_link = self._get_remote_link(self._root_node)
+        if remote_link:
+            mdl, remote_name = remote_link
+            return mdl.objects.filter(**{remote_name:self._root_node.key})
+
+    @classmethod
+    def _get_remote_link(cls, root_model):
+        """
+        Args:
+            root_model: Model (class or instance) that this list node belongs to.
+
+        Returns:
+            Linked model class and the query field of it which refers
+            back to the root model, None if list node has no links.
+        """
+        links = cls.get_links()
         if links:
             lnk = links[0]
-            root_lnk = self._root_node.get_link(field=self.__class__.__name__, startswith=True)
+            root_lnk = root_model.get_link(field=cls.__name__, startswith=True)
             if root_lnk['reverse'].endswith('_set'):
                 remote_name = un_camel_id("%s.%s" % (root_lnk['reverse'], root_lnk['reverse'][:-4]))
             else:
                 remote_name = un_camel_id(root_lnk['reverse'])
-            return lnk['mdl'].objects.filter(**{remote_name:self._root_node.key})
+            return lnk['mdl'], remote_name
 
     def _load_data(self, data, from_db=False):
         """
@@ -94,6 +109,8 @@ class ListNode(Node):
             node_dict={},
         )
         self._from_db = from_db
+        if not from_db:
+            self._mark_dirty(None)
 
     def _generate_instances(self):
         """
@@ -117,13 +134,13 @@ class ListNode(Node):
             ListNode item.
         """
         node_data['from_db'] = self._from_db
-        clone = self.__call__(**node_data)
+        clone = self._add_item(**node_data)
         clone.setattrs(container = self,
                     _is_item = True)
         for name in self._nodes:
             _name = un_camel(name)
             if _name in node_data:  # check for partial data
-                getattr(clone, name)._load_data(node_data[_name])
+                getattr(clone, name)._load_data(node_data[_name], self._from_db)
         _key = clone._get_linked_model_key()
         if _key:
             self.node_dict[_key] = clone
@@ -184,6 +201,7 @@ class ListNode(Node):
             kwargs: attributes of the ListNode
         """
         self._data.append(kwargs)
+        self._mark_dirty(None)
 
     def pre_add(self):
         """
@@ -195,7 +213,20 @@ class ListNode(Node):
         """
         Stores created instance in node_stack and returns it's reference to callee
         """
+        clone = self._add_item(**kwargs)
+        self._mark_dirty(None)
+        return clone
+
+    def _add_item(self, **kwargs):
+        """
+        Creates an item and stores it in node_stack, without marking
+        the list node as changed. Also used for items of loaded data.
+
+        Returns:
+            ListNode item.
+        """
         kwargs['_root_node'] = self._root_node
+        kwargs['_top_name'] = self._top_name
         clone = self.__class__(**kwargs)
         clone.setattrs(_is_item = True)
         clone.pre_add()
@@ -216,6 +247,7 @@ class ListNode(Node):
             raise TypeError("This an item of the parent ListNode")
         self.node_stack = []
         self._data = []
+        self._mark_dirty(None)
 
     def __contains__(self, item):
         if self._data:
@@ -238,6 +270,7 @@ class ListNode(Node):
         if self._is_item:
             raise TypeError("This an item of the parent ListNode")
         self.node_stack[key] = value
+        self._mark_dirty(None)
 
     def __delitem__(self, obj, sync=True):
         """
@@ -263,6 +296,7 @@ class ListNode(Node):
         else:
             _obj = obj
         self.node_stack.remove(_obj)
+        self._mark_dirty(None)
         if _lnk_key and sync:
             # this is a "many_to_n" relationship,
             # we should cleanup other side too.
@@ -287,3 +321,4 @@ class ListNode(Node):
         if not self._is_item:
             raise TypeError("Should be called on an item, not ListNode's itself.")
         self.container.node_stack.remove(self)
+        self._mark_dirty(None)
@@ -218,12 +218,44 @@ class ReIndex(Command, BaseThreadedCommand):
                'help': 'Models name(s) to be excluded, comma separated'},
               {'name': 'include_deleted', 'action': 'store_true',
                'help': 'Reindex object even if it was deleted'},
-              {'name': 'threads', 'default': 1, 'help': 'Max number of threads. Defaults to 1'}
+              {'name': 'threads', 'default': 1, 'help': 'Max number of threads. Defaults to 1'},
+              {'name': 'cursor', 'action': 'store_true',
+               'help': 'Walk through the search index with a cursor instead of listing '
+                       'bucket keys. Much faster on big buckets, but only reaches '
+                       'objects that are already indexed.'},
+              {'name': 'batch_size', 'type': int, 'default': 1000,
+               'help': 'Retrieve this amount of records from Solr in one time, '
+                       'only used with --cursor. Defaults to 1000'},
               ]
 
     def run(self):
         models = self.find_models()
-        self.do_with_submit(self.reindex_model, models, threads=self.manager.args.threads)
+        reindex = self.reindex_model_by_cursor if self.manager.args.cursor else self.reindex_model
+        self.do_with_submit(reindex, models, threads=self.manager.args.threads)
+
+    def reindex_model_by_cursor(self, mdl):
+        querysets = [mdl.objects.all()]
+        if self.manager.args.include_deleted:
+            querysets.append(mdl.objects.all(deleted=True))
+        i = 0
+        unsaved_keys = []
+        for queryset in querysets:
+            for obj in queryset.cursor(self.manager.args.batch_size):
+                try:
+                    obj.save(force=True)
+                    i += 1
+                except ConflictError:
+                    unsaved_keys.append(obj.key)
+                    print("Error on save. Record in conflict: %s > %s" % (mdl.__name__, obj.key))
+                except:
+                    unsaved_keys.append(obj.key)
+                    print("Error on save! %s > %s" % (mdl.__name__, obj.key))
+                    import traceback
+
+                    traceback.print_exc()
+        print("Re-indexed %s records of %s" % (i, mdl.__name__))
+        if unsaved_keys:
+            print("\nThese keys cannot be updated:\n\n", unsaved_keys)
 
     def reindex_model(self, mdl):
         stream = mdl.objects.adapter.bucket.stream_keys()
@@ -235,12 +267,12 @@ class ReIndex(Command, BaseThreadedCommand):
                 t += 1
                 # time.sleep(0.4)
                 try:
-                    mdl.objects.get(key).save()
+                    mdl.objects.get(key).save(force=True)
                     i += 1
                 except ObjectDoesNotExist:
                     if self.manager.args.include_deleted:
                         o = mdl.objects.filter(key=key, deleted=True)[0]
-                        o.save()
+                        o.save(force=True)
                         i += 1
                         print("Deleted object found: %s " % o.key)
 
@@ -383,31 +415,16 @@ class BaseDumpHandler(BaseThreadedCommand):
             print('Dumping {model}'.format(model=mdl.__name__))
 
         model = mdl(super_context)
-        count = model.objects.count()
-        rounds = int(count / self._batch_size) + 1
         bucket = model.objects.adapter.bucket
 
         self.pre_dump_hook(bucket)
-        for i in range(rounds):
-
-            start = 0 if self._remove_dumped else i
-
-            data = model.objects.data().raw('*:*').order_by('timestamp').set_params(
-                rows=self._batch_size,
-                start=start * self._batch_size,
-            )
-
-            try:
-                for value, key in data:
-                    if value is not None:
-                        self.handle_data(bucket, key, value)
-                        self.post_handle_data_hook(bucket, key, value)
-                if self._remove_dumped:
-                    # wait 1 second to pass for next round
-                    print("removed dumped objects from riak, waiting for solr sync")
-                    time.sleep(5)
-            except ValueError:
-                raise
+        # cursor keeps its position even if dumped objects are removed
+        # from riak while we are walking through the results.
+        data = model.objects.data().raw('*:*').order_by('timestamp').cursor(self._batch_size)
+        for value, key in data:
+            if value is not None:
+                self.handle_data(bucket, key, value)
+                self.post_handle_data_hook(bucket, key, value)
         self.post_dump_hook(bucket)
 
     def write(self, data):
@@ -8,16 +8,19 @@ This module holds the pyoko's Model object
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 import six
-import time
+from six.moves.urllib.parse import quote
 
-from pyoko.exceptions import IntegrityError, ObjectDoesNotExist
+from pyoko.exceptions import IntegrityError, ObjectDoesNotExist, ValidationError
 from .node import Node, FakeContext
+from .hydrator import Hydrator
 from . import fields as field
 from .db.queryset import QuerySet
 from .lib.utils import un_camel, lazy_property, pprnt, un_camel_id
 import weakref
 from pyoko.conf import settings
 from pyoko.db.connection import cache
+from pyoko.db import local_cache
+from pyoko.db.visibility import VisibilityWaiter
 super_context = FakeContext()
 
 # kept for backwards-compatibility
@@ -62,26 +65,7 @@ class Model(Node):
         # this indicates cell filters applied and we can filter on them
         # self._is_unpermitted_fields_set = False
         # self._context = context
-        self.setattrs(
-            key=kwargs.pop('key', None),
-            _unpermitted_fields=[],
-            _context=context,
-            verbose_name=kwargs.get('verbose_name'),
-            null=kwargs.get('null', False),
-            unique=kwargs.get('unique'),
-            reverse_name=kwargs.get('reverse_name'),
-            _pass_perm_checks=kwargs.pop('_pass_perm_checks', False),
-            _is_one_to_one=kwargs.pop('one_to_one', False),
-            title=kwargs.pop('title', self.__class__.__name__),
-            _root_node=self,
-            new_back_links={},
-            _just_created=None,
-            just_created=None,
-            on_save=[],
-            _exists=None,
-            help_text=kwargs.get('help_text'),
-            _initial_data={}
-        )
+        self._set_model_attrs(context, kwargs)
         # self.verbose_name = kwargs.get('verbose_name')
         # self.null = kwargs.get('null', False)
         # self.unique = kwargs.get('unique')
@@ -105,6 +89,44 @@ class Model(Node):
         self._instance_registry.add(weakref.ref(self))
         # self.saved_models = []
 
+    def _set_model_attrs(self, context, kwargs):
+        """
+        Sets the per-instance attributes of the model. Used by __init__
+        and :class:`pyoko.hydrator.Hydrator`, so both create the same instance.
+
+        Args:
+            context: Context of the instance.
+            kwargs (dict): Keyword arguments of the model, used ones are popped.
+        """
+        self.setattrs(
+            key=kwargs.pop('key', None),
+            _unpermitted_fields=[],
+            _context=context,
+            verbose_name=kwargs.get('verbose_name'),
+            null=kwargs.get('null', False),
+            unique=kwargs.get('unique'),
+            reverse_name=kwargs.get('reverse_name'),
+            _pass_perm_checks=kwargs.pop('_pass_perm_checks', False),
+            _is_one_to_one=kwargs.pop('one_to_one', False),
+            title=kwargs.pop('title', self.__class__.__name__),
+            _root_node=self,
+            new_back_links={},
+            _just_created=None,
+            just_created=None,
+            on_save=[],
+            _exists=None,
+            help_text=kwargs.get('help_text'),
+            _initial_data={},
+            # top level names of fields, nodes and links changed since _initial_data
+            _dirty_fields=set(),
+            # riak vclock of the object, kept to store it without reading first
+            _vclock=None,
+            # serialized data that is known to be stored in db, used to skip no-op saves
+            _stored_data=None,
+            # key is set from the natural key, stored only if no object has it yet
+            _create_with_key=False,
+        )
+
     def __str__(self):
         try:
             return self.__unicode__()
@@ -229,6 +251,17 @@ class Model(Node):
         return (self._unpermitted_fields if self._is_unpermitted_fields_set else
                 self._apply_cell_filters(self._context))
 
+    @classmethod
+    def _get_hydrator(cls):
+        """
+        Returns:
+            :class:`~pyoko.hydrator.Hydrator` of the model, None if its
+            instances can't be built by a hydrator.
+        """
+        if cls._hydrator is None:
+            cls._hydrator = Hydrator(cls) if Hydrator.supports(cls) else False
+        return cls._hydrator or None
+
     @staticmethod
     def row_level_access(context, objects):
         """
@@ -294,7 +327,7 @@ class Model(Node):
                             ))
                         linked_mdl_ins.save(internal=True)
                 else:
-                    linked_mdl_ins.setattr(remote_field_name, self._root_node)
+                    linked_mdl_ins._set_link(remote_field_name, self._root_node)
                     if linked_mdl_ins._exists is False:
                         raise ObjectDoesNotExist('Linked object %s on field %s with key %s doesn\'t exist' % (
                             linked_mdl_ins.__class__.__name__,
@@ -338,6 +371,7 @@ class Model(Node):
         Reloads current instance from DB store
         """
         self._load_data(self.objects.data().filter(key=self.key)[0][0], True)
+        self.setattrs(_vclock=None, _stored_data=None)
 
     def pre_save(self):
         """
@@ -392,69 +426,110 @@ class Model(Node):
         Checks marked as unique and unique_together fields of the Model at each
         creation and update, and if it violates the uniqueness raises IntegrityError.
 
-        First, looks at the fields which marked as "unique". If Model's unique fields
-        did not change, it means that there is still a record at db with same unique
-        field values. So, it must be checked that if more than one result violates the
-        uniqueness. If it is, raise an IntegrityError. Otherwise, when marked as unique
-        fields in the list of changed fields, it must be checked that if exists any
-        violation instead of more than one. And, if it is, again raise an IntegrityError.
+        All constraints are checked with a single query which looks for other
+        records that have the same values for any of them. Then the matching
+        records are compared with this object to find the violated constraint.
 
-        Then, looks at the fields which marked as "unique_together" with the same logic.
+        Constraints that have an empty value are not checked. For existing objects,
+        constraints whose fields did not change since the last save are skipped too.
 
         Raises:
             IntegrityError if unique and unique_together checks does not pass
         """
+        constraints = [(u,) for u in self._uniques] + [tuple(u) for u in
+                                                       self.Meta.unique_together]
+        if not constraints:
+            return
+
+        def _name(u):
+            # name of the field or linked model in serialized data
+            return u if u in self._fields else un_camel_id(u)
+
+        natural_key = set(self.Meta.natural_key)
+        if natural_key:
+            # these are guaranteed by the key itself, see _handle_natural_key()
+            constraints = [c for c in constraints if not natural_key.issubset(c)]
+            if not constraints:
+                return
+        current = self.clean_value(names=set(_name(u) for c in constraints for u in c))
+        changed_fields = self.changed_fields(from_db=True) if self.exist else None
+        checks = []
+        for uniques in constraints:
+            vals = dict((_name(u), current.get(_name(u))) for u in uniques)
+            if any(val is None or val == '' for val in vals.values()):
+                continue
+            if changed_fields is not None and not changed_fields.intersection(vals):
+                continue
+            checks.append((uniques, vals))
+        if not checks:
+            return
+
+        query = self.objects.or_filter(*[vals for uniques, vals in checks])
+        if self.exist:
+            query = query.exclude(key=self.key)
+        for data, key in query.data():
+            for uniques, vals in checks:
+                if all(data.get(name) == val for name, val in vals.items()):
+                    if len(uniques) == 1:
+                        raise IntegrityError("Unique mismatch: %s for %s already exists for value: "
+                                             "%s" % (uniques[0], self.__class__.__name__,
+                                                     vals[_name(uniques[0])]))
+                    raise IntegrityError(
+                        "Unique together mismatch: %s combination already exists for %s"
+                        % (vals, self.__class__.__name__))
 
-        def _getattr(u):
-            try:
-                return self._field_values[u]
-            except KeyError:
-                return getattr(self, u)
+    @classmethod
+    def _natural_key_of(cls, values):
+        """
+        Args:
+            values (dict): Values of the natural key fields.
 
-        if self._uniques:
-            for u in self._uniques:
-                val = _getattr(u)
-                changed_fields = self.changed_fields(from_db=True)
-                if self.exist and not (u in changed_fields if not callable(val) else
-                                       (str(u) + "_id") in changed_fields):
-                    if val and self.objects.filter(**{u: val}).count() > 1:
-                        raise IntegrityError("Unique mismatch: %s for %s already exists for value: "
-                                             "%s" % (u, self.__class__.__name__, val))
-                else:
-                    if val and self.objects.filter(**{u: val}).count():
-                        raise IntegrityError("Unique mismatch: %s for %s already exists for value: "
-                                             "%s" % (u, self.__class__.__name__, val))
-        if self.Meta.unique_together:
-            changed_fields = self.changed_fields(from_db=True)
-            for uniques in self.Meta.unique_together:
-                vals = dict([(u, _getattr(u)) for u in uniques])
-                if self.exist:
-                    query_is_changed = []
-                    for uni in vals.keys():
-                        if callable(vals[uni]):
-                            is_changed = (str(uni) + "_id") in changed_fields
-                            query_is_changed.append(is_changed)
-                        else:
-                            is_changed = uni in changed_fields
-                            query_is_changed.append(is_changed)
-                    is_unique_changed = any(query_is_changed)
-                    if not is_unique_changed:
-                        if self.objects.filter(**vals).count() > 1:
-                            raise IntegrityError(
-                                "Unique together mismatch: %s combination already exists for %s"
-                                % (vals, self.__class__.__name__))
-                    else:
-                        if self.objects.filter(**vals).count():
-                            raise IntegrityError(
-                                "Unique together mismatch: %s combination already exists for %s"
-                                % (vals, self.__class__.__name__))
-                else:
-                    if self.objects.filter(**vals).count():
-                        raise IntegrityError(
-                            "Unique together mismatch: %s combination already exists for %s"
-                            % (vals, self.__class__.__name__))
+        Returns:
+            Riak key derived from given values, None if the model has no
+            natural key, values are not exactly of its fields or some are empty.
+        """
+        natural_key = cls.Meta.natural_key
+        if not natural_key or set(values) != set(natural_key):
+            return None
+        parts = []
+        for name in natural_key:
+            val = cls._fields[name].clean_value(values[name])
+            if val is None or val == '':
+                return None
+            parts.append(quote(six.text_type(val).encode('utf-8'), safe=''))
+        return ':'.join(parts)
+
+    def _handle_natural_key(self):
+        """
+        Sets the key of a new object from its natural key fields, after making sure
+        that there isn't any object with the same key by reading it from riak.
+        Vclock of a deleted object with the same key is kept, so it's overwritten
+        without reading it again. Otherwise the object is stored only if the key
+        is still free, see :meth:`Adapter._store_model`.
+        Natural key fields of existing objects can not be changed.
 
-    def save(self, internal=False, meta=None, index_fields=None):
+        Raises:
+            ValidationError if natural key fields are empty or changed.
+            IntegrityError if an object already exists with the same natural key.
+        """
+        natural_key = self.Meta.natural_key
+        if self.exist:
+            if (self.changed_fields() or set()).intersection(natural_key):
+                raise ValidationError("Natural key fields %s of %s can not be changed" % (
+                    natural_key, self.__class__.__name__))
+            return
+        key = self._natural_key_of(dict((name, self._field_values.get(name))
+                                        for name in natural_key))
+        if key is None:
+            raise ValidationError("Natural key fields %s of %s can not be empty" % (
+                natural_key, self.__class__.__name__))
+        obj = self.objects.adapter.bucket.get(key)
+        if obj.exists and not obj.data['deleted']:
+            raise IntegrityError("Natural key mismatch: %s for %s already exists" % (
+                key, self.__class__.__name__))
+        self.setattrs(key=key, _vclock=obj.vclock, _create_with_key=not obj.exists)
+
+    def save(self, internal=False, meta=None, index_fields=None, blind_write=False, force=False):
         """
         Save's object to DB.
 
@@ -469,28 +544,71 @@ class Model(Node):
             index_fields (list): Tuple list for indexing keys in riak (with 'bin' or 'int').
                 bin is used for string fields, int is used for integer fields.
                 [('lorem','bin'),('dolar','int')]
+            blind_write (bool): Don't read the object from riak before storing it,
+                if it's not loaded from db in this instance. Last write wins.
+            force (bool): Store the object even if its data is not changed
+                since it's loaded or saved. Storing of an unchanged object is
+                skipped, but its hooks still run and its relations are still
+                processed, like they are for a stored one.
 
         Returns:
              Saved model instance.
         """
-        for f in self.on_save:
-            f(self)
-        if not (internal or self._pre_save_hook_called):
+        old_data, clean_value = self._prepare_save(internal, force=force)
+        self.objects.save_model(self, meta_data=meta, index_fields=index_fields,
+                                blind_write=blind_write, force=force,
+                                clean_value=clean_value)
+        self._finish_save(old_data, internal)
+        return self
+
+    def _prepare_save(self, internal=False, hooks=True, force=False):
+        """
+        Runs the pre save steps: hooks and uniqueness checks. Uniqueness is not
+        checked if the save will be skipped since the object is not changed.
+
+        Args:
+            internal (bool): True if called within model.
+            hooks (bool): False to skip on_save, pre_save and pre_creation hooks.
+            force (bool): The object will be stored even if it's not changed.
+
+        Returns:
+            tuple: Object's data before save and its serialized data, which is None
+                unless it's serialized to check if the object is changed.
+        """
+        if hooks:
+            for f in self.on_save:
+                f(self)
+        if hooks and not (internal or self._pre_save_hook_called):
             self._pre_save_hook_called = True
             self.pre_save()
-        if not self.deleted:
+        # new objects are serialized after pre_creation hook, by the adapter
+        clean_value = self.clean_value() if not force and self._stored_data else None
+        if not (self.deleted or (clean_value is not None and
+                                 self.objects.adapter._is_unchanged(self, clean_value))):
             self._handle_uniqueness()
-        if not self.exist:
+        if hooks and not self.exist:
             self.pre_creation()
         old_data = self._data.copy()
         if self.just_created is None:
             self.setattrs(just_created=not self.exist)
         if self._just_created is None:
             self.setattrs(_just_created=self.just_created)
-        self.objects.save_model(self, meta_data=meta, index_fields=index_fields)
+        if self.Meta.natural_key:
+            self._handle_natural_key()
+        return old_data, clean_value
+
+    def _finish_save(self, old_data, internal=False, hooks=True):
+        """
+        Runs the post save steps: relation updates and hooks.
+
+        Args:
+            old_data (dict): Object's data before save.
+            internal (bool): True if called within model.
+            hooks (bool): False to skip post_save and post_creation hooks.
+        """
         self._handle_changed_fields(old_data)
         self._process_relations(internal)
-        if not (internal or self._post_save_hook_called):
+        if hooks and not (internal or self._post_save_hook_called):
             self._post_save_hook_called = True
             self.post_save()
             if self._just_created:
@@ -500,8 +618,9 @@ class Model(Node):
         self._pre_save_hook_called = False
         self._post_save_hook_called = False
         if not internal:
-            self._initial_data = self.clean_value()
-        return self
+            self._initial_data = (self.clean_value() if self._stored_data is None
+                                  else self._stored_data)
+            self._dirty_fields.clear()
 
     def changed_fields(self, from_db=False):
         """
@@ -511,15 +630,18 @@ class Model(Node):
             list: List of fields names which their values changed.
         """
         if self.exist:
-            current_dict = self.clean_value()
-            # `from_db` attr is set False as default, when a `ListNode` is
-            # initialized just after above `clean_value` is called. `from_db` flags
-            # in 'list node sets' makes differences between clean_data and object._data.
-
-            db_data = self._initial_data
             if from_db:
+                current_dict = self.clean_value()
+                # `from_db` attr is set False as default, when a `ListNode` is
+                # initialized just after above `clean_value` is called. `from_db` flags
+                # in 'list node sets' makes differences between clean_data and object._data.
                 # Thus, after clean_value, object's data is taken from db again.
                 db_data = self.objects.data().get(self.key)[0]
+            else:
+                # only the fields, nodes and links that are set since
+                # the object is loaded or saved can differ from _initial_data
+                current_dict = self.clean_value(names=self._dirty_fields)
+                db_data = self._initial_data
 
             set_current, set_past = set(current_dict.keys()), set(db_data.keys())
             intersect = set_current.intersection(set_past)
@@ -557,8 +679,9 @@ class Model(Node):
             self.setattr(query, query_dict[query])
 
         self.save(meta=meta, index_fields=index_fields)
-        while not self.objects.filter(key=self.key, **query_dict).count():
-            time.sleep(0.3)
+        waiter = VisibilityWaiter(self.__class__, query_dict)
+        waiter.add(self.key)
+        waiter.wait()
         return self
 
     def blocking_delete(self, meta=None, index_fields=None):
@@ -571,8 +694,9 @@ class Model(Node):
             [('lorem','bin'),('dolar','int')]
         """
         self.delete(meta=meta, index_fields=index_fields)
-        while self.objects.filter(key=self.key).count():
-            time.sleep(0.3)
+        waiter = VisibilityWaiter(self.__class__, {'deleted': True})
+        waiter.add(self.key)
+        waiter.wait()
 
     def _traverse_relations(self):
         for lnk in self.get_links(link_source=False):
@@ -587,7 +711,7 @@ class Model(Node):
                 if lnkd_model._TYPE == 'ListNode':
                     del lnkd_model[self]
                 elif lnkd_model._TYPE == 'Model':
-                    rel.setattr(key, lnkd_model.__class__())
+                    rel._set_link(key, lnkd_model.__class__())
                 # binding actual relation's save to our save
                 self.on_save.append(lambda self: rel.save(internal=True))
 
@@ -622,6 +746,7 @@ class Model(Node):
             self.post_delete()
             if settings.ENABLE_CACHING:
                 cache.delete(self.key)
+                local_cache.invalidate(self.key)
         return results, errors
 
 
@@ -121,12 +121,15 @@ class ModelMeta(type):
         attrs['save_meta_data'] = None
         attrs['_pre_save_hook_called'] = False
         attrs['_post_save_hook_called'] = False
+        # built at first use, see Model._get_hydrator()
+        attrs['_hydrator'] = None
         DEFAULT_META = {'bucket_type': settings.DEFAULT_BUCKET_TYPE,
                         'field_permissions': {},
                         'app': 'main',
                         'list_fields': [],
                         'list_filters': [],
                         'search_fields': [],
+                        'natural_key': (),
                         }
         if 'Meta' not in attrs:
             attrs['Meta'] = type('Meta', (object,), DEFAULT_META)
@@ -47,6 +47,22 @@ class LazyModel(lazy_object_proxy.Proxy):
         super(LazyModel, self).__init__(wrapped)
 
 
+def linked_model_loader(mdl, context, key, null, verbose_name):
+    """
+    Returns a function that reads the linked model with given key for a
+    LazyModel. An empty instance marked as missing is returned if it doesn't exist.
+    """
+    def load():
+        try:  # workaround for #5094 / GH-46
+            return mdl(context, null=null, verbose_name=verbose_name).objects.get(key)
+        except (ObjectDoesNotExist, MultipleObjectsReturned):
+            missing_object = mdl(context, null=null, verbose_name=verbose_name)
+            missing_object._exists = False
+            return missing_object
+
+    return load
+
+
 class FakeContext(object):
     """
     this fake context object can be used to use
@@ -106,18 +122,40 @@ class Node(object):
                                        val.__class__.__name__,
                                        _attr.__class__.__name__,
                                        getattr(_attr, '_TYPE', None)))
+            if not key.startswith('_') and (key.endswith('_id') or
+                                            getattr(val, '_TYPE', None) == 'Model' or
+                                            self.__dict__.get('_top_name')):
+                # a linked model, its key or an attribute of a node
+                self._mark_dirty(key if key.endswith('_id') else un_camel_id(key))
         object.__setattr__(self, key, val)
 
-    def __init__(self, **kwargs):
-        self.setattrs(
-            _node_path=[],
-            _field_values={},
-            _secured_data={},
-            _choice_fields=[],
-            _data={},
-            _choices_manager=get_object_from_path(settings.CATALOG_DATA_MANAGER),
+    def _mark_dirty(self, name):
+        """
+        Records a change on the root model, as the given name
+        or as the top level node that this node belongs to.
 
-        )
+        Args:
+            name (str): Name of the changed field or link.
+        """
+        name = self._top_name or name
+        dirty_fields = (self._root_node or self).__dict__.get('_dirty_fields')
+        if dirty_fields is not None and name is not None:
+            dirty_fields.add(name)
+
+    def _set_link(self, name, val):
+        """
+        Sets a linked model without the type checks of __setattr__
+        and records the change of its key.
+
+        Args:
+            name (str): Name of the link.
+            val: Model instance.
+        """
+        self.setattr(name, val)
+        self._mark_dirty(un_camel_id(name))
+
+    def __init__(self, **kwargs):
+        self._set_node_attrs(kwargs.pop('_top_name', None))
         super(Node, self).__init__()
         try:
             self._root_node
@@ -141,6 +179,27 @@ class Node(object):
         self._instantiate_nodes()
         self._set_fields_values(kwargs)
 
+    def _set_node_attrs(self, top_name=None, choices_manager=None):
+        """
+        Sets the per-instance attributes of the node. Used by __init__
+        and :class:`pyoko.hydrator.Hydrator`, so both create the same instance.
+
+        Args:
+            top_name (str): Serialized name of the top level node which contains this node.
+            choices_manager: Catalog data manager, looked up from settings if not given.
+        """
+        self.setattrs(
+            _node_path=[],
+            _field_values={},
+            _secured_data={},
+            _choice_fields=[],
+            _data={},
+            _choices_manager=(choices_manager or
+                              get_object_from_path(settings.CATALOG_DATA_MANAGER)),
+            # serialized name of the top level node which contains this node
+            _top_name=top_name,
+        )
+
     def get_verbose_name(self):
         """
         Returns:
@@ -178,6 +237,9 @@ class Node(object):
         cls._debug_linked_models[mdl.__name__].append(debug_lnk)
         if lnk not in cls._linked_models[mdl.__name__]:
             cls._linked_models[mdl.__name__].append(lnk)
+            if '_hydrator' in cls.__dict__:
+                # links are changed, hydrator will be rebuilt at next use
+                cls._hydrator = None
 
     @classmethod
     def _get_bucket_name(cls):
@@ -246,6 +308,9 @@ class Node(object):
             #     continue
             self.setattr(lnk['field'] + '_id', "")
             if data:
+                if not data.get('from_db'):
+                    # link is set (or reset) by the user
+                    self._mark_dirty(un_camel_id(lnk['field']))
                 # data can be came from db or user
                 if lnk['field'] in data and isinstance(data[lnk['field']], Model):
                     # this should be coming from user,
@@ -266,22 +331,9 @@ class Node(object):
                     if _name in data and data[_name] is not None:
                         # this is coming from db,
                         # we're preparing a lazy model loader
-                        def fo(modl, context, key):
-                            def fo2():
-                                try:  # workaround for #5094 / GH-46
-                                    return modl(context,
-                                                null=lnk['null'],
-                                                verbose_name=lnk['verbose']).objects.get(key)
-                                except (ObjectDoesNotExist, MultipleObjectsReturned):
-                                    missing_object = modl(context,
-                                                          null=lnk['null'],
-                                                          verbose_name=lnk['verbose'])
-                                    missing_object._exists = False
-                                    return missing_object
-
-                            return fo2
-
-                        obj = LazyModel(fo(lnk['mdl'], self._context, data[_name]),
+                        obj = LazyModel(linked_model_loader(lnk['mdl'], self._context,
+                                                            data[_name], lnk['null'],
+                                                            lnk['verbose']),
                                         lnk['null'],
                                         lnk['verbose'])
                         obj.key = data[_name]
@@ -307,7 +359,8 @@ class Node(object):
     def _instantiate_node(self, name, klass):
         # instantiate given node, pass path and _root_node info
         ins = klass(**{'context': self._context,
-                       '_root_node': self._root_node or self})
+                       '_root_node': self._root_node or self,
+                       '_top_name': self._top_name or un_camel(name)})
         ins.setattr('_node_path', self._node_path + [un_camel(self.__class__.__name__)])
         self.setattr(name, ins)
         return ins
@@ -454,16 +507,20 @@ class Node(object):
         del self._data['from_db']
         return self
 
-    def _clean_node_value(self, dct):
+    def _clean_node_value(self, dct, names=None):
         # get values of nodes
         for name in self._nodes:
+            if names is not None and un_camel(name) not in names:
+                continue
             node = getattr(self, name)
             dct[un_camel(name)] = node.clean_value()
         return dct
 
-    def _clean_field_value(self, dct):
+    def _clean_field_value(self, dct, names=None):
         # get values of fields
         for name, field_ins in self._fields.items():
+            if names is not None and un_camel(name) not in names:
+                continue
             path_name = self._path_of(name)
             if path_name in self._secured_data:
                 dct[un_camel(name)] = self._secured_data[path_name]
@@ -471,21 +528,24 @@ class Node(object):
                 dct[un_camel(name)] = field_ins.clean_value(self._field_values.get(name))
         return dct
 
-    def _clean_linked_model_value(self, dct):
+    def _clean_linked_model_value(self, dct, names=None):
         # get keys of linked models
         for lnk in self.get_links(is_set=False):
-            lnkd_mdl = getattr(self, lnk['field'])
             mdl_id = un_camel_id(lnk['field'])
+            if names is not None and mdl_id not in names:
+                continue
+            lnkd_mdl = getattr(self, lnk['field'])
             dct[mdl_id] = getattr(self, mdl_id) or (lnkd_mdl.key if lnkd_mdl is not None else '')
 
-    def clean_value(self):
+    def clean_value(self, names=None):
         """
         generates a json serializable representation of the model data
+        :param names: only serialize these top level names if given
         :rtype: dict
         :return: riak ready python dict
         """
         dct = {}
-        self._clean_field_value(dct)
-        self._clean_node_value(dct)
-        self._clean_linked_model_value(dct)
+        self._clean_field_value(dct, names)
+        self._clean_node_value(dct, names)
+        self._clean_linked_model_value(dct, names)
         return dct
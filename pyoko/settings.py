@@ -34,6 +34,17 @@ VERSION_SUFFIX = os.environ.get('VERSION_SUFFIX', '_version')
 #: write-once log bucket
 ENABLE_ACTIVITY_LOGGING = os.environ.get('ENABLE_ACTIVITY_LOGGING', 'False') == 'True'
 
+#: Set True to store versions as diffs against the previous version of
+#: the object, with a full snapshot at every VERSION_SNAPSHOT_INTERVAL versions.
+ENABLE_VERSION_DELTAS = os.environ.get('ENABLE_VERSION_DELTAS', 'False') == 'True'
+VERSION_SNAPSHOT_INTERVAL = int(os.environ.get('VERSION_SNAPSHOT_INTERVAL', 20))
+
+#: Number of objects whose last version is kept in memory to diff new versions against.
+VERSION_CACHE_SIZE = int(os.environ.get('VERSION_CACHE_SIZE', 1000))
+
+#: Number of version records kept in memory after they are read.
+VERSION_READ_CACHE_SIZE = int(os.environ.get('VERSION_READ_CACHE_SIZE', 1000))
+
 #: Set the name of logging bucket type and bucket name.
 ACTIVITY_LOGGING_BUCKET = os.environ.get('ACTIVITY_LOGGING_BUCKET', 'log')
 VERSION_BUCKET = os.environ.get('VERSION_BUCKET', 'version')
@@ -43,3 +54,54 @@ ENABLE_CACHING = os.environ.get('ENABLE_CACHING', 'False') == 'True'
 
 #: Set True to enable caching all models to Redis
 CACHE_EXPIRE_DURATION = os.environ.get('CACHE_EXPIRE_DURATION', 36000)
+
+#: Set True to keep recently used objects in an in-process cache
+#: in front of Redis. Requires ENABLE_CACHING.
+ENABLE_LOCAL_CACHE = os.environ.get('ENABLE_LOCAL_CACHE', 'False') == 'True'
+
+#: Max number of objects kept in the in-process cache.
+LOCAL_CACHE_SIZE = int(os.environ.get('LOCAL_CACHE_SIZE', 1000))
+
+#: Seconds an object is kept in the in-process cache.
+LOCAL_CACHE_TTL = int(os.environ.get('LOCAL_CACHE_TTL', 60))
+
+#: Redis pub/sub channel that carries cache invalidations between processes.
+CACHE_INVALIDATION_CHANNEL = os.environ.get('CACHE_INVALIDATION_CHANNEL',
+                                            'pyoko_cache_invalidation')
+
+#: Number of result pages that are fetched ahead (keys from solr,
+#: objects from riak) while iterating over a queryset.
+STREAM_READ_AHEAD = int(os.environ.get('STREAM_READ_AHEAD', 2))
+
+#: Number of worker threads of the process-wide riak multiget pool.
+#: This is the cap on concurrent riak fetches of a process.
+MULTIGET_POOL_SIZE = int(os.environ.get('MULTIGET_POOL_SIZE', 10))
+
+#: Max number of waiting multiget tasks, 0 means unbounded.
+MULTIGET_QUEUE_SIZE = int(os.environ.get('MULTIGET_QUEUE_SIZE', 0))
+
+#: Number of worker threads of the process-wide executor
+#: which runs solr page fetches and multigets of querysets.
+EXECUTOR_POOL_SIZE = int(os.environ.get('EXECUTOR_POOL_SIZE', 10))
+
+#: Default number of concurrent stores of QuerySet.bulk_save.
+BULK_SAVE_CONCURRENCY = int(os.environ.get('BULK_SAVE_CONCURRENCY', 10))
+
+#: Seconds to wait at most for saved objects to be indexed,
+#: by blocking_save, blocking_delete and BlockSave.
+INDEX_VISIBILITY_TIMEOUT = float(os.environ.get('INDEX_VISIBILITY_TIMEOUT', 60))
+
+#: Set True to write version and activity log records in background
+#: workers (write-behind) instead of in the save call.
+ENABLE_WRITE_BEHIND = os.environ.get('ENABLE_WRITE_BEHIND', 'False') == 'True'
+
+#: Maximum number of pending write-behind records.
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', 10000))
+
+#: Number of write-behind worker threads and records taken by a worker at once.
+WRITE_BEHIND_WORKERS = int(os.environ.get('WRITE_BEHIND_WORKERS', 4))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 50))
+
+#: Seconds a save waits for room when write-behind queue is full,
+#: the record is dropped (and counted) after that.
+WRITE_BEHIND_BLOCK_TIMEOUT = float(os.environ.get('WRITE_BEHIND_BLOCK_TIMEOUT', 1))
@@ -28,3 +28,10 @@ class Uniques(Model):
     class Meta:
         unique_together = [('id', 'foo_id'), ('rel', 'other_rel')]
 
+
+class NaturalKeys(Model):
+    code = field.String()
+    name = field.String()
+
+    class Meta:
+        natural_key = ('code',)
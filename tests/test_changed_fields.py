@@ -54,3 +54,40 @@ class TestCase:
         assert r.is_changed('usr_id') == r.is_changed('active') == True
         assert 'active' and 'usr_id' in r.changed_fields()
         r.active = bool
+
+    def test_dirty_fields(self):
+        s = Student.objects.all()[0]
+        assert not s._dirty_fields
+        assert not s.changed_fields()
+        s.name = '%s_dirty' % s.name
+        s.Lectures(name='dirty_lecture')
+        assert s._dirty_fields == {'name', 'lectures'}
+        assert s.changed_fields() == {'name', 'lectures'}
+        s.save()
+        assert not s._dirty_fields
+        assert not s.changed_fields()
+
+    def test_dirty_links_and_list_nodes(self):
+        user = User(name='dirty_link').save()
+        other = User(name='dirty_link_other').save()
+        role = Role(usr=user, name='dirty_link').blocking_save()
+        loaded = Role.objects.get(role.key)
+        loaded._load_data({'usr': other, 'name': 'dirty_link'})
+        assert 'usr_id' in loaded.changed_fields()
+        # non-fast update replaces the link of loaded objects
+        assert Role.objects.filter(key=role.key).update(usr=other) == 1
+        assert Role.objects.get(role.key).usr.key == other.key
+
+        s = Student(name='dirty_list')
+        s.Lectures(name='dirty_lecture', code='dirty')
+        s = Student.objects.get(s.save().key)
+        # reading a list node doesn't change it
+        assert [lecture.code for lecture in s.Lectures] == ['dirty']
+        assert not s.changed_fields()
+        s.Lectures[0].Exams(type='dirty')
+        assert s.changed_fields() == {'lectures'}
+        s = Student.objects.get(s.key)
+        s.set_data({'lectures': [{'name': 'replaced', 'code': 'replaced'}]})
+        assert 'lectures' in s.changed_fields()
+        s.save()
+        assert [lecture.code for lecture in Student.objects.get(s.key).Lectures] == ['replaced']
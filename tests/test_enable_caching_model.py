@@ -8,6 +8,7 @@
 
 from tests.models import Student
 from pyoko.db.connection import cache
+from pyoko.db import local_cache
 import json
 import six
 from pyoko import settings
@@ -62,3 +63,47 @@ class TestCase():
 
 
 
+
+    def test_multi_get_from_cache(self):
+        if settings.ENABLE_CACHING:
+            s1 = Student(name='mget_1').blocking_save()
+            s2 = Student(name='mget_2').blocking_save()
+            cache.delete(s1.key, s2.key)
+            adapter = Student.objects.adapter
+            keys = [(adapter._cfg['bucket_type'], adapter._cfg['bucket_name'], s.key)
+                    for s in (s1, s2)]
+
+            objs, misses = adapter.multi_get_from_cache(keys)
+            assert not objs and misses == keys
+
+            # misses are fetched from riak and written back to cache
+            assert len(adapter.riak_multi_get(keys)) == 2
+            objs, misses = adapter.multi_get_from_cache(keys)
+            assert not misses
+            assert dict(objs)[s1.key]['name'] == 'mget_1'
+
+            s1.blocking_delete()
+            s2.blocking_delete()
+
+    def test_local_cache(self):
+        if settings.ENABLE_CACHING and settings.ENABLE_LOCAL_CACHE:
+            s = Student(name='local_1').blocking_save()
+            Student.objects.get(s.key)
+            assert local_cache.get(s.key)['name'] == 'local_1'
+
+            # objects and data that are read from the local tier don't share it
+            local_cache.get(s.key)['name'] = 'modified'
+            st = Student.objects.get(s.key)
+            st.Lectures(name='local_lecture')
+            list(st.Lectures)
+            Student.objects.data().get(s.key)[0]['name'] = 'modified'
+            assert local_cache.get(s.key)['name'] == 'local_1'
+            assert Student.objects.get(s.key).name == 'local_1'
+            assert not list(Student.objects.get(s.key).Lectures)
+
+            s.name = 'local_2'
+            s.blocking_save()
+            assert Student.objects.get(s.key).name == 'local_2'
+
+            s.blocking_delete()
+            assert local_cache.get(s.key) is None
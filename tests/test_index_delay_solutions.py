@@ -7,9 +7,11 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 import time
+from threading import Thread
 
 from .models import Student
 from pyoko.db.adapter.db_riak import BlockSave, BlockDelete
+from pyoko.db.visibility import VisibilityWaiter
 
 
 class TestCase:
@@ -21,10 +23,11 @@ class TestCase:
     def test_block_save(self):
         Student.objects.all().delete()
         t1 = time.time()
-        with BlockSave(Student):
+        with BlockSave(Student) as block:
             for i in range(10):
                 Student(surname='bar', name='foo_%s' % i).save()
         assert Student.objects.count() == 10
+        assert block.elapsed is not None and not block.pending
         print("BlockSave took %s" % (time.time() - t1))
         student = Student.objects.get(surname='bar', name='foo_9')
         student.blocking_save(query_dict={"name": "foo_10", "surname": "bar_10"})
@@ -54,3 +57,14 @@ class TestCase:
         assert Student.objects.count() == 0
         print("BlockDelete took %s" % (time.time() - t1))
 
+
+    def test_visibility_waiter_is_thread_local(self):
+        waiter = VisibilityWaiter(Student)
+        with waiter:
+            thread = Thread(target=lambda: Student(name='other_thread').save())
+            thread.start()
+            thread.join()
+            assert not waiter.pending
+            Student(name='this_thread').save()
+            assert len(waiter.pending) == 1
+        assert not waiter.pending
@@ -6,17 +6,22 @@
 #
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
+import copy
 import datetime
+from collections import OrderedDict
 from time import sleep
 import pytest
+import riak
 from pyoko.conf import settings
 from pyoko.db.adapter.db_riak import BlockSave, BlockDelete, Adapter
-from pyoko.exceptions import MultipleObjectsReturned
+from pyoko.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 from pyoko.manage import FlushDB
 from tests.data.test_data import data, clean_data
 from tests.models import Student, TimeTable, User, Role
 from pyoko.db.adapter.base import BaseAdapter
-from pyoko.db.connection import client
+from pyoko.db.connection import client, get_multiget_pool, get_executor, get_http_connection
+from pyoko.db import visibility
+from pyoko.db.write_overlay import WriteOverlay
 import time
 
 
@@ -68,6 +73,24 @@ class TestCase:
         clean_data['updated_at'] = clean_value['updated_at']
         assert clean_data == clean_value
 
+    def test_hydrated_model(self):
+        st = self.prepare_testbed()
+        data = Student.objects.data().get(st.key)[0]
+        st2 = Student.objects.get(st.key)
+        generic = Student().set_data(data, from_db=True)
+        generic.setattr('key', st.key)
+        clean_value, generic_value = st2.clean_value(), generic.clean_value()
+        generic_value['updated_at'] = clean_value['updated_at']
+        assert clean_value == generic_value
+        assert st2.Lectures[0].role.key == generic.Lectures[0].role.key
+        assert (set(name for name in st2.__dict__ if name.endswith('_display')) ==
+                set(name for name in generic.__dict__ if name.endswith('_display')))
+        assert st2.changed_fields() == set()
+        st2.name = 'hydrated'
+        assert st2.changed_fields() == {'name'}
+        # list node items don't modify the stored data
+        assert st2._initial_data == data
+
     def test_get_multiple_objects_exception(self):
         self.prepare_testbed()
         Student(name='Foo').blocking_save()
@@ -147,9 +170,12 @@ class TestCase:
             time.sleep(0.3)
 
         # Wanted result from filter method much than default row_size.
-        # It should raise an exception.
+        # It should raise an exception when the query is executed.
+        qs = Student.objects.filter()
         with pytest.raises(Exception):
-            Student.objects.filter()
+            list(qs)
+        # slicing narrows the result, so it's allowed.
+        assert len(list(qs[:10])) == 10
 
         # Results are taken from solr in ordered with 'timestamp' sort parameter.
         results = mb.search('-deleted:True', 'pyoko_models_student',
@@ -416,3 +442,115 @@ class TestCase:
         with BlockDelete(Role):
             for r in role_lst:
                 r.delete()
+
+    def test_cursor_pagination(self):
+        self.prepare_testbed(True)
+        with BlockSave(Student):
+            for i in range(7):
+                Student(name='cursor_%s' % i).save()
+        keys = [st.key for st in Student.objects.order_by('name')]
+        cursor_keys = [st.key for st in Student.objects.order_by('name').cursor(3)]
+        assert len(cursor_keys) == Student.objects.count()
+        assert keys == cursor_keys
+        assert len(list(Student.objects.filter(name='cursor_1').cursor(3))) == 1
+        # solr parameters are kept
+        qs = Student.objects.all().set_params(fq='name:cursor_1').cursor(3)
+        assert [st.name for st in qs] == ['cursor_1']
+        # pages are fetched over the same connection
+        conn = get_http_connection()
+        assert len(list(Student.objects.all().cursor(3))) == Student.objects.count()
+        assert get_http_connection() is conn
+        with pytest.raises(riak.RiakError) as err:
+            list(Student.objects.all().set_params(sort='no_such_field asc').cursor(3))
+        assert 'QUERY DEBUG' in err.value.value
+
+    def test_paging(self):
+        self.prepare_testbed(True)
+        with BlockSave(Student):
+            for i in range(7):
+                Student(name='page_%s' % i).save()
+        keys = [st.key for st in Student.objects.order_by('name')]
+        assert len(keys) == len(set(keys)) == 8
+        qs = Student.objects.order_by('name')
+        qs.adapter.page_size = 3
+        assert [st.key for st in qs] == keys
+        assert qs.count() == 8
+        # pages of a start offset are fetched with start/rows parameters
+        qs = Student.objects.order_by('name').set_params(start=1)
+        qs.adapter.page_size = 3
+        assert [st.key for st in qs] == keys[1:]
+
+    def test_shared_pools(self):
+        self.prepare_testbed()
+        pool, executor = get_multiget_pool(), get_executor()
+        assert list(Student.objects.all())
+        assert list(User.objects.all())
+        assert get_multiget_pool() is pool
+        assert get_executor() is executor
+
+    def test_clone(self):
+        qs = Student.objects.filter(name='clone').order_by('name')
+        query, params = qs.adapter._solr_query, copy.deepcopy(qs.adapter._solr_params)
+        clone = qs.filter(number='1').order_by('-number').set_params(rows=5)
+        # parent queryset isn't modified by its clones
+        assert qs.adapter._solr_query == query
+        assert qs.adapter._solr_params == params
+        assert clone.adapter._solr_query[:len(query)] == query
+        assert clone.adapter._solr_params['sort'] == OrderedDict([('timestamp', 'desc'),
+                                                                  ('name', 'asc'),
+                                                                  ('number', 'desc')])
+        assert clone.adapter.bucket is qs.adapter.bucket
+
+    def test_count_memo(self, monkeypatch):
+        self.prepare_testbed(True)
+        Student(name='memo').blocking_save()
+        qs = Student.objects.filter(name='memo')
+        assert [st.name for st in qs] == ['memo']
+        counted_qs = Student.objects.filter(name='memo')
+        assert counted_qs.count() == 1
+
+        def fail(self, *args):
+            raise AssertionError("count of a listed queryset is queried again")
+
+        # count is taken from the first page of the listing
+        monkeypatch.setattr(Adapter, '_exec_query', fail)
+        monkeypatch.setattr(Adapter, '_exec_cursor_query', fail)
+        assert qs.count() == len(qs) == 1
+        # and the first page fetched by count is used by the listing
+        assert [st.name for st in counted_qs] == ['memo']
+        # root querysets aren't memoized
+        assert Student.objects._result_count is None
+
+    def test_compiled_query(self):
+        qs = Student.objects.filter(name='query test').filter(number=1)
+        qs.adapter._compile_query()
+        query = qs.adapter.compiled_query
+        assert query == '(name:query\\ test AND number:1) AND -deleted:True'
+        qs = Student.objects.filter(name='query test').filter(number='1')
+        qs.adapter._compile_query()
+        assert qs.adapter.compiled_query == query
+        qs = Student.objects.filter(name='a&&b||c')
+        qs.adapter._compile_query()
+        assert qs.adapter.compiled_query == '(name:a\\&&b\\||c) AND -deleted:True'
+
+    def test_write_overlay(self):
+        with WriteOverlay():
+            st = Student(name='overlay', number='overlay_1').save()
+            assert Student.objects.filter(number='overlay_1').count() == 1
+            assert [s.key for s in Student.objects.filter(number='overlay_1')] == [st.key]
+            assert Student.objects.filter(number='overlay_1').get().key == st.key
+            st.delete()
+            assert Student.objects.filter(number='overlay_1').count() == 0
+            assert not list(Student.objects.filter(number='overlay_1'))
+            with pytest.raises(ObjectDoesNotExist):
+                Student.objects.filter(number='overlay_1').get()
+            # text fields can only be queried on solr
+            assert Student.objects.filter(name='overlay').adapter._local_filters() is None
+
+    def test_write_overlay_count_batches(self, monkeypatch):
+        # written objects are checked on solr in batches
+        monkeypatch.setattr(visibility, 'BATCH_SIZE', 2)
+        with WriteOverlay():
+            for i in range(5):
+                Student(name='overlay', number='overlay_batch').save()
+            assert Student.objects.filter(number='overlay_batch').count() == 5
@@ -9,8 +9,9 @@
 from pprint import pprint, pformat
 from time import sleep, time
 
-from pyoko.exceptions import ObjectDoesNotExist
+from pyoko.exceptions import ObjectDoesNotExist, PyokoError
 from pyoko.manage import FlushDB
+from pyoko.db import queryset
 from .models import *
 import pytest
 
@@ -282,4 +283,57 @@ class TestCase:
         # # Second role's student set number should increase one.
         # assert len(second_role.student_set) == 1
         # # Second role's student set's student object's data is controlled.
-        # assert second_role.student_set[0].student.clean_value()['lecturer'][0]['role_id'] == second_role.key
\ No newline at end of file
+        # assert second_role.student_set[0].student.clean_value()['lecturer'][0]['role_id'] == second_role.key
+    def test_select_related(self):
+        self.prepare_testbed()
+        u = User(name="Selected").save()
+        mate = User(name="Selected Mate").save()
+        role = Role(usr=u, teammate=mate, name="select_related").blocking_save()
+        roles = list(Role.objects.filter(name="select_related").select_related('usr',
+                                                                                 'teammate'))
+        assert len(roles) == 1 and roles[0].key == role.key
+        # linked models are attached as instances, not as lazy proxies
+        assert type(roles[0].usr) is User
+        assert roles[0].usr.name == u.name
+        assert roles[0].teammate.name == mate.name
+        with pytest.raises(PyokoError):
+            Role.objects.select_related('not_a_link')
+
+    def test_prefetch_related(self):
+        self.prepare_testbed()
+        u = User(name="Prefetched").blocking_save()
+        roles = set(Role(usr=u, name="prefetch_%s" % i).blocking_save().key for i in range(2))
+        users = list(User.objects.filter(name="Prefetched").prefetch_related('roller'))
+        assert len(users) == 1
+        prefetched = users[0].roller.objects
+        assert prefetched._prefetched is not None
+        assert prefetched.count() == 2
+        assert set(r.key for r in prefetched) == roles
+        assert set(item.role.key for item in users[0].roller) == roles
+        with pytest.raises(PyokoError):
+            User.objects.prefetch_related('not_a_set')
+
+    def test_prefetch_related_chunks(self, monkeypatch):
+        self.prepare_testbed()
+        users = [User(name="Prefetched chunk").blocking_save() for i in range(3)]
+        roles = dict((Role(usr=u, name="prefetch_chunk").blocking_save().key, u.key)
+                     for u in users)
+        monkeypatch.setattr(queryset, 'PREFETCH_CHUNK_SIZE', 2)
+        qs = User.objects.filter(name="Prefetched chunk").prefetch_related('roller')
+        for user in qs:
+            assert [(r.key, user.key) for r in user.roller.objects] == [
+                (key, user_key) for key, user_key in roles.items() if user_key == user.key]
+        # pages that end up empty don't run a query
+        qs._prefetch_related_page([])
+
+    def test_fast_delete(self, monkeypatch):
+        self.prepare_testbed()
+        users = [User(name="fast_delete").blocking_save() for i in range(3)]
+        roles = [Role(usr=user, name="fast_delete_role").blocking_save() for user in users]
+        # related objects are queried with chunks of deleted keys
+        monkeypatch.setattr(queryset, 'PREFETCH_CHUNK_SIZE', 2)
+        assert User.objects.all(name="fast_delete").delete(fast=True) == 3
+        sleep(1)
+        assert User.objects.all(name="fast_delete").count() == 0
+        for role in roles:
+            assert not Role.objects.get(role.key).usr.key
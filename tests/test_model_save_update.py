@@ -8,11 +8,13 @@
 # (GPLv3).  See LICENSE.txt for details.
 from time import sleep
 
+from pyoko.conf import settings
 from pyoko.manage import FlushDB
-from pyoko.exceptions import ObjectDoesNotExist
+from pyoko.exceptions import ObjectDoesNotExist, PyokoError
 from pyoko.db.adapter.db_riak import BlockSave
+from pyoko.db.connection import log_bucket, version_bucket
 from tests.data.test_data import data
-from .models import Student, User
+from .models import Student, User, Employee
 import pytest
 
 
@@ -120,3 +122,96 @@ class TestCase:
 
         # Cleanup
         user.delete()
+
+    def test_bulk_save(self):
+        self.prepare_testbed(True)
+        students = [Student(name='bulk_%s' % i) for i in range(20)]
+        with BlockSave(Student):
+            saved, failed = Student.objects.bulk_save(students, concurrency=5)
+        assert not failed
+        assert len(saved) == 20 and all(st.exist for st in saved)
+        assert Student.objects.filter(name__startswith='bulk_').count() == 20
+        assert Student.objects.get(students[3].key).name == 'bulk_3'
+
+    def test_bulk_save_hooks(self):
+        employees = [Employee(eid='bulk_%s' % i) for i in range(3)]
+        saved, failed = Employee.objects.bulk_save(employees, hooks=False)
+        assert not failed
+        assert all(e.pre_save_counter == 0 and e.post_save_counter == 0 for e in saved)
+        saved, failed = Employee.objects.bulk_save(employees)
+        assert all(e.pre_save_counter == 1 and e.post_save_counter == 1 for e in saved)
+        for e in saved:
+            e.blocking_delete()
+
+    def test_fast_update(self):
+        self.prepare_testbed(True)
+        with BlockSave(Student):
+            for i in range(5):
+                Student(pno='fast_update', number=str(i)).save()
+        assert Student.objects.all(pno='fast_update').fast_update({'surname': 'Updated'}) == 5
+        sleep(1)
+        for st in Student.objects.all(pno='fast_update'):
+            assert st.surname == 'Updated'
+            assert st.number in ['0', '1', '2', '3', '4']
+        with pytest.raises(PyokoError):
+            Student.objects.all(pno='fast_update').fast_update({'Lectures': []})
+
+    def test_fast_update_log_records(self):
+        self.prepare_testbed()
+        with BlockSave(Student):
+            students = [Student(pno='fast_update_log', number=str(i)).save() for i in range(5)]
+        meta = {'lorem': 'fast_update_log'}
+        assert Student.objects.all(pno='fast_update_log').fast_update(
+            {'surname': 'Logged'}, meta=meta, index_fields=[('lorem', 'bin')]) == 5
+        assert meta == {'lorem': 'fast_update_log'}
+        if not (settings.ENABLE_VERSIONS and settings.ENABLE_ACTIVITY_LOGGING):
+            return
+        log_keys = log_bucket.get_index('lorem_bin', 'fast_update_log').results
+        version_keys = [log_bucket.get(k).data['version_key'] for k in log_keys]
+        assert len(version_keys) == len(set(version_keys)) == 5
+        assert (set(version_bucket.get(k).data['key'] for k in version_keys) ==
+                set(st.key for st in students))
+
+    def test_save_with_loaded_vclock(self):
+        self.prepare_testbed()
+        st = Student(name='vclock').save()
+        assert st._vclock is not None
+        st = Student.objects.get(st.key)
+        if not settings.ENABLE_CACHING:
+            # objects read from cache are stored after reading from riak
+            assert st._vclock is not None
+        st.surname = 'Loaded'
+        st.save()
+        assert Student.objects.get(st.key).surname == 'Loaded'
+        blind = Student(key=st.key, name='vclock', surname='Blind')
+        blind.save(blind_write=True)
+        assert Student.objects.get(st.key).surname == 'Blind'
+
+    def test_skip_unchanged_save(self):
+        self.prepare_testbed()
+        st = Student(name='noop').save()
+        vclock = st._vclock
+        st.save()
+        assert st._vclock == vclock
+        st = Student.objects.get(st.key)
+        updated_at = st.updated_at
+        st.save()
+        assert Student.objects.get(st.key).updated_at == updated_at
+        st.save(force=True)
+        assert Student.objects.get(st.key).updated_at != updated_at
+
+    def test_save_serializes_once(self, monkeypatch):
+        self.prepare_testbed()
+        st = Student.objects.get(Student(name='serialize').save().key)
+        calls = []
+        clean_value = Student.clean_value
+
+        def counting_clean_value(self, names=None):
+            calls.append(names)
+            return clean_value(self, names)
+
+        monkeypatch.setattr(Student, 'clean_value', counting_clean_value)
+        st.name = 'serialized'
+        st.save()
+        assert calls == [None]
+        assert Student.objects.get(st.key).name == 'serialized'
@@ -10,9 +10,9 @@ from time import sleep
 
 import pytest
 
-from pyoko.exceptions import IntegrityError
+from pyoko.exceptions import IntegrityError, ValidationError
 from pyoko.manage import FlushDB
-from .models import Uniques, UniqRelation, OtherUniqRelation
+from .models import Uniques, UniqRelation, OtherUniqRelation, NaturalKeys
 
 
 class TestCase():
@@ -22,7 +22,8 @@ class TestCase():
     @classmethod
     def prepare_testbed(cls, reset=False):
         if (not cls.cleaned_up) or reset:
-            FlushDB(model='Uniques,UniqRelation,OtherUniqRelation', wait_sync=True).run()
+            FlushDB(model='Uniques,UniqRelation,OtherUniqRelation,NaturalKeys',
+                    wait_sync=True).run()
             cls.cleaned_up = True
 
     def test_unique(self):
@@ -93,5 +94,63 @@ class TestCase():
         assert u_username == p.username
         assert rel == p.rel
 
+    def test_unique_unchanged_update(self):
+        self.prepare_testbed()
+        uni = Uniques(id='m', foo_id='n', username='foo10').save()
+        sleep(1)
+        uni.name = 'changed'
+        uni.save()
+        sleep(1)
+        assert Uniques.objects.or_filter({'username': 'foo10'},
+                                         {'id': 'm', 'foo_id': 'n'}).count() == 1
+
+    def test_unique_and_unique_together_save(self):
+        self.prepare_testbed()
+        uni = Uniques(id='r1', foo_id='r2', rel=UniqRelation().save(),
+                      other_rel=OtherUniqRelation().save(), username='foo20').save()
+        assert uni.exist
+        sleep(1)
+        uni.name = 'changed'
+        uni.save()
+        assert Uniques.objects.or_filter(username='foo20', id='none').count() == 1
+        with pytest.raises(IntegrityError):
+            Uniques(id='r1', foo_id='r2', username='foo21').save()
+        with pytest.raises(IntegrityError):
+            Uniques(id='r3', foo_id='r4', username='foo20').save()
 
+    def test_unchanged_save_skips_uniqueness(self, monkeypatch):
+        self.prepare_testbed()
+        uni = Uniques(id='s1', foo_id='s2', username='foo22').save()
+
+        def fail(self):
+            raise AssertionError("uniqueness is checked for an unchanged object")
+
+        monkeypatch.setattr(Uniques, '_handle_uniqueness', fail)
+        uni.save()
+        with pytest.raises(AssertionError):
+            uni.save(force=True)
+
+    def test_natural_key(self):
+        self.prepare_testbed()
+        obj, created = NaturalKeys.objects.get_or_create({'name': 'First'}, code='a/b c')
+        assert created
+        assert obj.key == 'a%2Fb%20c'
+        # read by key, without waiting for indexing
+        same, created = NaturalKeys.objects.get_or_create(code='a/b c')
+        assert not created and same.name == 'First'
+        assert NaturalKeys.objects.get(code='a/b c').key == obj.key
+        with pytest.raises(IntegrityError):
+            NaturalKeys(code='a/b c', name='Second').save()
+        with pytest.raises(ValidationError):
+            obj.code = 'other'
+            obj.save()
 
+    def test_natural_key_race(self):
+        self.prepare_testbed()
+        obj = NaturalKeys(code='race', name='First')
+        # key is checked, then another creator stores the same natural key
+        obj._handle_natural_key()
+        NaturalKeys(code='race', name='Second').save()
+        with pytest.raises(IntegrityError):
+            obj.save()
+        assert NaturalKeys.objects.get(code='race').name == 'Second'
@@ -7,7 +7,16 @@
 # This file is licensed under the GNU General Public License v3
 # (GPLv3).  See LICENSE.txt for details.
 # from ulakbus.models.personel import Personel
+import time
+
+import pytest
+from six.moves.queue import Queue
+
+from pyoko.conf import settings
+from pyoko.db import write_behind
+from pyoko.db.adapter import db_riak
 from pyoko.db.connection import log_bucket, version_bucket
+from pyoko.exceptions import ObjectDoesNotExist
 from .models import AbstractRole
 
 
@@ -73,6 +82,92 @@ class TestCase():
         # Name key should be defined name.
         assert deleted_and_name_control == ('sample_name', True)
 
+    def test_delta_versions(self):
+        settings.ENABLE_VERSION_DELTAS = True
+        try:
+            role = AbstractRole(name='delta_0').save()
+            first_version = version_bucket.get_index('key_bin', role.key).results
+            for i in range(1, 4):
+                role.name = 'delta_%s' % i
+                role.save()
+        finally:
+            settings.ENABLE_VERSION_DELTAS = False
+        version_keys = version_bucket.get_index('key_bin', role.key).results
+        assert len(version_keys) == 4
+        names = []
+        for version_key in version_keys:
+            record = version_bucket.get(version_key).data
+            if version_key in first_version:
+                assert 'data' in record
+            else:
+                assert 'data' not in record
+                assert set(record['diff']['set']) <= {'name', 'updated_at'}
+            names.append(AbstractRole.objects.get_version(version_key)['data']['name'])
+        assert sorted(names) == ['delta_0', 'delta_1', 'delta_2', 'delta_3']
+
+    def test_delta_after_dropped_version(self):
+        full_queue = Queue(maxsize=1)
+        full_queue.put(None)
+        get_queue, block_timeout = write_behind._get_queue, settings.WRITE_BEHIND_BLOCK_TIMEOUT
+        settings.ENABLE_VERSION_DELTAS = True
+        try:
+            role = AbstractRole(name='dropped_0').save()
+            write_behind._get_queue = lambda: full_queue
+            settings.WRITE_BEHIND_BLOCK_TIMEOUT = 0
+            settings.ENABLE_WRITE_BEHIND = True
+            dropped = write_behind.stats()['dropped']
+            role.name = 'dropped_1'
+            role.save()
+            assert write_behind.stats()['dropped'] == dropped + 1
+            settings.ENABLE_WRITE_BEHIND = False
+            role.name = 'dropped_2'
+            role.save()
+        finally:
+            write_behind._get_queue = get_queue
+            settings.WRITE_BEHIND_BLOCK_TIMEOUT = block_timeout
+            settings.ENABLE_WRITE_BEHIND = False
+            settings.ENABLE_VERSION_DELTAS = False
+        history = list(AbstractRole.objects.history(role.key))
+        assert [r.name for r in history] == ['dropped_0', 'dropped_2']
+
+    def test_history(self):
+        role = AbstractRole(name='history_0').save()
+        for i in range(1, 3):
+            role.name = 'history_%s' % i
+            role.save()
+        history = list(AbstractRole.objects.history(role.key))
+        assert [r.name for r in history] == ['history_0', 'history_1', 'history_2']
+        assert all(r.key == role.key for r in history)
+        second = history[1]
+        assert AbstractRole.objects.as_of(role.key, second._version_timestamp).name == 'history_1'
+        assert AbstractRole.objects.as_of(role.key, time.time()).name == 'history_2'
+        with pytest.raises(ObjectDoesNotExist):
+            AbstractRole.objects.as_of(role.key, history[0]._version_timestamp - 1)
+
+    def test_as_of_search_windows(self, monkeypatch):
+        role = AbstractRole(name='window_0').save()
+        role.name = 'window_1'
+        role.save()
+        # last version is found after widening the searched window
+        monkeypatch.setattr(db_riak, 'VERSION_SEARCH_WINDOW', 0.000001)
+        assert AbstractRole.objects.as_of(role.key, time.time() + 3600).name == 'window_1'
+
+    def test_write_behind(self):
+        settings.ENABLE_WRITE_BEHIND = True
+        try:
+            role = AbstractRole(name='write_behind').save(meta=self.meta_data,
+                                                          index_fields=self.index_fields)
+        finally:
+            settings.ENABLE_WRITE_BEHIND = False
+        write_behind.flush()
+        stats = write_behind.stats()
+        assert stats['pending'] == stats['dropped'] == stats['failed'] == 0
+        version_keys = version_bucket.get_index('key_bin', role.key).results
+        assert len(version_keys) == 1
+        assert version_bucket.get(version_keys[0]).data['data']['name'] == 'write_behind'
+        log_keys = log_bucket.get_index('version_key_bin', version_keys[0]).results
+        assert len(log_keys) == 1
+
 
 def common_controls_without_meta_data(self):
     # Controlling log_bucket remain same.